@@ -1,13 +1,32 @@
 # app.py - Enhanced AI Service for Accord Chat with Rate Limiting
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import logging
+import math
+import os
 import time
 from datetime import datetime
 import re
+import sys
 from functools import wraps
-import threading
+from cache import ResponseCache, cache_key
+from singleflight import SingleFlight, SingleFlightTimeout
+from summary import ConversationSummaries, split_messages
+from prompt_budget import PromptBudget
+from ratelimit import RateLimiter, RateLimitPolicy, MemoryBackend, create_backend
+import metrics
+from health import BackendProbe
+from models import ModelManager
+from batching import MicroBatcher, BATCH_WINDOW_MS
+from scheduler import GenerationScheduler, QueueFullError, DeadlineExceeded, PRIORITIES, QUEUE_RETRY_AFTER
+from breaker import CircuitBreaker, CircuitOpenError
+from prompt_cache import PrefixCache, PROMPT_LAYOUT
+# Modules shared with the contract generator live in ../shared
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'shared'))
+from backend_pool import BackendPool, parse_urls
 
 # Configure logging
 logging.basicConfig(
@@ -17,42 +36,181 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+START_TIME = time.time()
 
 # Configuration
-OLLAMA_API_URL = "http://localhost:11434/api/generate"
+# Comma-separated list of Ollama servers; the first also serves /health/deep
+OLLAMA_URLS = parse_urls(os.getenv("OLLAMA_URLS", "http://localhost:11434"))
+OLLAMA_BASE_URL = OLLAMA_URLS[0]
+OLLAMA_API_URL = f"{OLLAMA_BASE_URL}/api/generate"
 MAX_RESPONSE_LENGTH = 1500
-MAX_CHAT_HISTORY_LENGTH = 500000
-MAX_PROMPT_LENGTH = 6000
+NUM_PREDICT = 500
 REQUEST_TIMEOUT = 100
+CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", 3))
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", 10))
+OLLAMA_CONNECT_RETRIES = int(os.getenv("OLLAMA_CONNECT_RETRIES", 3))
+OLLAMA_RETRY_BACKOFF = float(os.getenv("OLLAMA_RETRY_BACKOFF", 0.5))
+SINGLE_FLIGHT_WAIT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_WAIT_TIMEOUT", REQUEST_TIMEOUT + CONNECT_TIMEOUT))
 RATE_LIMIT_REQUESTS = 10
 RATE_LIMIT_WINDOW = 60
+RATE_LIMIT_ALGORITHM = os.getenv("RATE_LIMIT_ALGORITHM", "token_bucket")  # or "sliding_window"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # or sqlite:///path.db, redis://host:6379/0
+RATE_LIMIT_KEY_HEADER = os.getenv("RATE_LIMIT_KEY_HEADER")  # e.g. X-Tenant-Id set by a trusted proxy
+# "route=limit/window" pairs, e.g. "/analyze=10/60,/ask=20/60"
+RATE_LIMIT_ROUTES = os.getenv("RATE_LIMIT_ROUTES", f"/analyze={RATE_LIMIT_REQUESTS}/{RATE_LIMIT_WINDOW},/ask={RATE_LIMIT_REQUESTS}/{RATE_LIMIT_WINDOW}")
+# "key=limit/window" pairs overriding the route policy for specific clients
+RATE_LIMIT_KEYS = os.getenv("RATE_LIMIT_KEYS", "")
 
-# Rate limiting storage
-rate_limit_data = {}
-rate_lock = threading.Lock()
+# User-facing messages for Ollama failures (shared with asgi.py)
+OLLAMA_ERROR_MESSAGES = {
+    'unavailable': "AI service is temporarily unavailable. Please try again shortly.",
+    'timeout': "I'm taking too long to respond. Please try again with a shorter message or different question.",
+    'offline': "AI service is currently offline. Please make sure Ollama is running.",
+    'request': "Temporary AI service issue. Please try again in a moment.",
+    'busy': "Too many AI requests are queued. Please try again shortly.",
+    'unexpected': "An unexpected error occurred. Please try again."
+}
+
+def create_http_session(pool_size=OLLAMA_POOL_SIZE):
+    """
+    Shared keep-alive session for Ollama calls. Only connection failures are
+    retried (with backoff) since nothing has reached the model at that point.
+    """
+    retry = Retry(
+        total=None,
+        connect=OLLAMA_CONNECT_RETRIES,
+        read=0,
+        status=0,
+        other=0,
+        backoff_factor=OLLAMA_RETRY_BACKOFF,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry, pool_block=False)
+    
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+class StreamCleaner:
+    """
+    Incremental version of AIService.clean_response for streamed output.
+    Trailing whitespace is held back until the next token arrives so that
+    blank-line runs split across tokens still collapse to a single gap.
+    """
+    def __init__(self, max_length=MAX_RESPONSE_LENGTH):
+        self.max_length = max_length
+        self.pending = ""
+        self.length = 0
+        self.exhausted = False
+    
+    def feed(self, token):
+        if self.exhausted or not token:
+            return ""
+        
+        self.pending = re.sub(r'\n\s*\n', '\n\n', self.pending + token)
+        if self.length == 0:
+            self.pending = self.pending.lstrip()
+        
+        text = self.pending.rstrip()
+        self.pending = self.pending[len(text):]
+        return self._emit(text)
+    
+    def finish(self):
+        if self.exhausted:
+            return ""
+        self.exhausted = True
+        self.pending = ""
+        if self.length == 0:
+            return "I couldn't generate a response. Please try again."
+        return ""
+    
+    def _emit(self, text):
+        remaining = self.max_length - self.length
+        if len(text) > remaining:
+            text = text[:remaining].rstrip() + "..."
+            self.exhausted = True
+        self.length += len(text)
+        return text
 
 class AIService:
     def __init__(self):
-        self.ollama_url = OLLAMA_API_URL
-        self.model = "llama3:instruct"
+        self.pool = BackendPool(OLLAMA_URLS)
+        self.session = create_http_session()
+        self.budget = PromptBudget(NUM_PREDICT)
+        # Loads must use the generation context size or Ollama reloads the model on first use
+        self.models = ModelManager(
+            self.session, self.pool.urls,
+            options={"num_ctx": self.budget.context_tokens}
+        )
+        self.model = self.models.model_for('chat')
+        self.scheduler = GenerationScheduler()
+        self.batcher = MicroBatcher(self.generate, self.scheduler.slots) if BATCH_WINDOW_MS > 0 else None
+        self.breaker = CircuitBreaker()
+        self.timeout = (CONNECT_TIMEOUT, REQUEST_TIMEOUT)
+        self.cache = ResponseCache()
+        self.inflight = SingleFlight()
+        self.summaries = ConversationSummaries(self.summarize_messages)
+        self.prefixes = PrefixCache(self.budget)
     
-    def truncate_chat_history(self, chat_data, max_length=MAX_CHAT_HISTORY_LENGTH):
-        if not chat_data or len(chat_data) <= max_length:
-            return chat_data
-        
-        truncated = chat_data[-max_length:]
-        logger.info(f"Truncated chat history from {len(chat_data)} to {len(truncated)} characters")
-        return f"...{truncated}"
+    def summarize_messages(self, previous_summary, new_messages):
+        prompt = f"""
+You maintain a running summary of a chat conversation for an AI assistant.
+
+**Current Summary:**
+{previous_summary or "(none yet)"}
+
+**New Messages:**
+{new_messages}
+
+**Rewrite the summary to include the new messages. Keep names, decisions, open questions and key facts. Plain text, at most one paragraph.**
+"""
+        summary, error = self.call_ollama(prompt, model=self.models.model_for('analysis'))
+        if error:
+            logger.warning(f"Summary update skipped: {error}")
+            return None
+        return summary
     
-    def generate_prompt(self, chat_data, user_prompt, analysis_mode=False):
-        truncated_chat = self.truncate_chat_history(chat_data)
+    def generate_prompt(self, chat_data, user_prompt, analysis_mode=False, conversation_id=None, model=None):
+        """
+        Returns (prompt, prefix). prefix is a PromptPrefix for conversations
+        in the stable layout; when it carries context, prompt holds only what
+        is new since the previous response.
+        """
+        messages = split_messages(chat_data or "")
+        summary = ""
+        if conversation_id and messages:
+            summary, messages = self.summaries.condense(str(conversation_id), messages)
+        
+        prefix_key = None
+        if conversation_id and PROMPT_LAYOUT == 'stable':
+            prefix_key = f"{conversation_id}:{'analysis' if analysis_mode else 'chat'}"
+        
+        if prefix_key and not analysis_mode:
+            template = """
+**New Messages:**
+{chat}
+
+**User's Message:**
+{question}
+
+**Response:**
+"""
+            continued = self.prefixes.continuation(
+                prefix_key, model or self.model, messages, summary,
+                reserve_tokens=self.budget.counter.count(template.format(chat="", question=user_prompt))
+            )
+            if continued:
+                context, new_messages = continued
+                prefix = self.prefixes.prefix(prefix_key, messages, summary, context)
+                return template.format(chat="\n".join(new_messages), question=user_prompt), prefix
         
         if analysis_mode:
-            prompt = f"""
+            template = """
 You are Accord, an AI communication analyst. Analyze this conversation briefly:
 
 **Recent Messages:**
-{truncated_chat}
+{chat}
 
 **Analysis Focus:**
 - Main topics discussed
@@ -61,15 +219,15 @@ You are Accord, an AI communication analyst. Analyze this conversation briefly:
 
 **Keep analysis concise (2-3 paragraphs max).**
 """
-        elif truncated_chat:
-            prompt = f"""
+        elif messages:
+            template = """
 You are Accord, a helpful AI assistant.
 
 **Recent Conversation:**
-{truncated_chat}
+{chat}
 
 **User's Message:**
-{user_prompt}
+{question}
 
 **Guidelines:**
 - Respond conversationally and helpfully
@@ -80,68 +238,294 @@ You are Accord, a helpful AI assistant.
 **Response:**
 """
         else:
-            prompt = f"""
+            template = """
 You are Accord, a helpful AI assistant.
 
 **User's Question:**
-{user_prompt}
+{question}
 
 **Please provide a concise, helpful response (1-2 paragraphs max).**
 """
         
-        if len(prompt) > MAX_PROMPT_LENGTH:
-            excess = len(prompt) - MAX_PROMPT_LENGTH
-            prompt = prompt[:MAX_PROMPT_LENGTH] + "\n[Content truncated due to length]"
-            logger.warning(f"Prompt truncated by {excess} characters")
+        # Instructions and the question are always sent whole; history gets
+        # whatever token budget remains. The stable layout keeps the window's
+        # first message fixed between calls so the prompt prefix is reusable.
+        chat = ""
+        if "{chat}" in template:
+            budget = self.budget.history_budget(template.format(chat="", question=user_prompt))
+            if prefix_key:
+                chat = self.prefixes.window(prefix_key, messages, budget, pinned=summary)
+            else:
+                chat = self.budget.fit_messages(messages, budget, pinned=summary)
         
-        return prompt
+        prefix = self.prefixes.prefix(prefix_key, messages, summary) if prefix_key else None
+        return template.format(chat=chat, question=user_prompt), prefix
     
-    def call_ollama(self, prompt):
+    def build_payload(self, prompt, stream=False, model=None, context=None):
         payload = {
-            "model": self.model,
+            "model": model or self.model,
             "prompt": prompt,
-            "stream": False,
+            "stream": stream,
+            "keep_alive": self.models.keep_alive,
             "options": {
                 "temperature": 0.7,
                 "top_p": 0.9,
-                "num_predict": 500,
+                "num_predict": NUM_PREDICT,
+                "num_ctx": self.budget.context_tokens,
                 "repeat_penalty": 1.1,
             }
         }
+        if context:
+            payload["context"] = context
+        return payload
+    
+    def remember_context(self, prefix, model, details):
+        if prefix and details.get("context"):
+            self.prefixes.remember(prefix, model, details["context"])
+    
+    def generate_url(self, backend):
+        return f"{backend.url}/api/generate"
+    
+    def payload_cache_key(self, payload):
+        options = payload["options"]
+        if payload.get("context"):
+            # The same text continues differently after a different context
+            options = dict(options, context=cache_key(payload["model"], json.dumps(payload["context"]), {}))
+        return cache_key(payload["model"], payload["prompt"], options)
+    
+    def call_ollama(self, prompt, use_cache=False, model=None, batch=False, priority='bulk', tenant=None, timeout=None,
+                    prefix=None, details=None):
+        """
+        Blocking generation. priority, tenant and timeout decide when the
+        request gets a backend slot; QueueFullError and CircuitOpenError
+        propagate to the route. prefix comes from generate_prompt; details,
+        if given, receives Ollama's prompt evaluation figures.
+        """
+        details = {} if details is None else details
+        payload = self.build_payload(prompt, model=model, context=prefix.context if prefix else None)
+        key = self.payload_cache_key(payload)
         
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                logger.info("Ollama response served from cache")
+                return cached, None
+        
+        # tenant doubles as the pool affinity key so a conversation keeps its backend
+        if batch and self.batcher:
+            generate = lambda: self.batcher.submit(payload, affinity=tenant, details=details)
+        else:
+            generate = lambda: self.generate(payload, affinity=tenant, details=details)
+        
+        def run():
+            # Fail fast while the backend is known to be down instead of queuing
+            self.breaker.check()
+            self.scheduler.acquire(priority, tenant, timeout)
+            try:
+                # A half-open probe is only taken once the call is sure to run and report back
+                self.breaker.allow()
+                return generate()
+            finally:
+                self.scheduler.release()
+        
+        # Identical prompts already being generated share that generation
+        try:
+            ai_response, error = self.inflight.do(key, run, timeout=SINGLE_FLIGHT_WAIT_TIMEOUT)
+        except SingleFlightTimeout:
+            logger.warning("Timed out waiting for shared Ollama generation")
+            return None, OLLAMA_ERROR_MESSAGES['timeout']
+        except DeadlineExceeded:
+            logger.warning(f"Dropped {priority} request for {tenant}: no backend slot before its deadline")
+            return None, OLLAMA_ERROR_MESSAGES['timeout']
+        
+        if use_cache and not error:
+            self.cache.set(key, ai_response)
+        if not error:
+            self.remember_context(prefix, payload["model"], details)
+        
+        return ai_response, error
+    
+    def record_details(self, details, data, payload):
+        if details is None:
+            return
+        details.update({
+            'prompt_eval_count': data.get("prompt_eval_count"),
+            'prompt_eval_ms': round(data["prompt_eval_duration"] / 1e6, 1) if data.get("prompt_eval_duration") else None,
+            'context_reused': bool(payload.get("context")),
+            'context': data.get("context")
+        })
+    
+    def generate(self, payload, affinity=None, details=None):
+        backend = self.pool.acquire(affinity)
+        metrics.GENERATIONS_IN_FLIGHT.inc()
+        start_time = time.time()
+        healthy = False
         try:
-            start_time = time.time()
-            response = requests.post(self.ollama_url, json=payload, timeout=REQUEST_TIMEOUT)
+            response = self.session.post(self.generate_url(backend), json=payload, timeout=self.timeout)
             response_time = time.time() - start_time
             
             logger.info(f"Ollama response time: {response_time:.2f}s")
             
             if response.status_code != 200:
                 logger.error(f"Ollama API error: {response.status_code}")
-                return None, "AI service is temporarily unavailable. Please try again shortly."
+                metrics.OLLAMA_ERRORS.inc(kind='http_status')
+                # A 4xx is our request's fault, not the backend's
+                healthy = response.status_code < 500
+                return None, OLLAMA_ERROR_MESSAGES['unavailable']
             
             response_data = response.json()
+            metrics.observe_ollama_response(
+                response_data, payload["model"], 'blocking', response_time, context_reused=bool(payload.get("context"))
+            )
+            self.record_details(details, response_data, payload)
             ai_response = response_data.get("response", "").strip()
             
             ai_response = self.clean_response(ai_response)
             
+            healthy = True
             return ai_response, None
             
         except requests.exceptions.Timeout:
             logger.warning("Ollama request timeout")
-            return None, "I'm taking too long to respond. Please try again with a shorter message or different question."
+            metrics.OLLAMA_ERRORS.inc(kind='timeout')
+            return None, OLLAMA_ERROR_MESSAGES['timeout']
             
         except requests.exceptions.ConnectionError:
             logger.error("Cannot connect to Ollama service")
-            return None, "AI service is currently offline. Please make sure Ollama is running."
+            metrics.OLLAMA_ERRORS.inc(kind='connection')
+            return None, OLLAMA_ERROR_MESSAGES['offline']
             
         except requests.exceptions.RequestException as e:
             logger.error(f"Ollama request exception: {str(e)}")
-            return None, "Temporary AI service issue. Please try again in a moment."
+            metrics.OLLAMA_ERRORS.inc(kind='request')
+            return None, OLLAMA_ERROR_MESSAGES['request']
             
         except Exception as e:
             logger.error(f"Unexpected error calling Ollama: {str(e)}")
-            return None, "An unexpected error occurred. Please try again."
+            metrics.OLLAMA_ERRORS.inc(kind='unexpected')
+            return None, OLLAMA_ERROR_MESSAGES['unexpected']
+        
+        finally:
+            metrics.GENERATIONS_IN_FLIGHT.dec()
+            self.pool.release(backend, healthy)
+            self.breaker.record(healthy, time.time() - start_time)
+    
+    def stream_ollama(self, prompt, model=None, priority='interactive', tenant=None, timeout=None, prefix=None, details=None):
+        """
+        Relays Ollama's NDJSON token stream as it is generated.
+        Yields (chunk, error) tuples; an error ends the stream.
+        """
+        details = {} if details is None else details
+        payload = self.build_payload(prompt, stream=True, model=model, context=prefix.context if prefix else None)
+        cleaner = StreamCleaner(MAX_RESPONSE_LENGTH)
+        
+        try:
+            self.breaker.check()
+            self.scheduler.acquire(priority, tenant, timeout)
+        except CircuitOpenError:
+            yield None, OLLAMA_ERROR_MESSAGES['unavailable']
+            return
+        except QueueFullError:
+            logger.warning("Generation queue full, rejecting stream")
+            yield None, OLLAMA_ERROR_MESSAGES['busy']
+            return
+        except DeadlineExceeded:
+            logger.warning(f"Dropped {priority} stream for {tenant}: no backend slot before its deadline")
+            yield None, OLLAMA_ERROR_MESSAGES['timeout']
+            return
+        
+        # Take a half-open probe only once the slot is held, so it always reports back
+        try:
+            self.breaker.allow()
+        except CircuitOpenError:
+            self.scheduler.release()
+            yield None, OLLAMA_ERROR_MESSAGES['unavailable']
+            return
+        
+        backend = self.pool.acquire(tenant)
+        metrics.GENERATIONS_IN_FLIGHT.inc()
+        start_time = time.time()
+        first_token_time = None
+        healthy = False
+        stopped = False  # the consumer closed the stream before it ended
+        try:
+            data = {}
+            
+            with self.session.post(self.generate_url(backend), json=payload, stream=True, timeout=self.timeout) as response:
+                if response.status_code != 200:
+                    logger.error(f"Ollama API error: {response.status_code}")
+                    metrics.OLLAMA_ERRORS.inc(kind='http_status')
+                    healthy = response.status_code < 500
+                    yield None, OLLAMA_ERROR_MESSAGES['unavailable']
+                    return
+                
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    
+                    data = json.loads(line)
+                    if data.get("error"):
+                        logger.error(f"Ollama stream error: {data['error']}")
+                        metrics.OLLAMA_ERRORS.inc(kind='stream')
+                        yield None, OLLAMA_ERROR_MESSAGES['request']
+                        return
+                    
+                    chunk = cleaner.feed(data.get("response", ""))
+                    if chunk:
+                        if first_token_time is None:
+                            first_token_time = time.time() - start_time
+                            logger.info(f"Ollama first token in {first_token_time:.2f}s")
+                        yield chunk, None
+                    
+                    if cleaner.exhausted or data.get("done"):
+                        break
+            
+            healthy = True
+            chunk = cleaner.finish()
+            if chunk:
+                yield chunk, None
+            
+            total_time = time.time() - start_time
+            metrics.observe_ollama_response(
+                data, payload["model"], 'stream', total_time, first_token_time, context_reused=bool(payload.get("context"))
+            )
+            logger.info(f"Ollama stream completed in {total_time:.2f}s - Length: {cleaner.length}")
+            if data.get("done"):
+                # Context only arrives when the model finished, not when we cut the stream
+                self.record_details(details, data, payload)
+                self.remember_context(prefix, payload["model"], details)
+            
+        except requests.exceptions.Timeout:
+            logger.warning("Ollama stream timeout")
+            metrics.OLLAMA_ERRORS.inc(kind='timeout')
+            yield None, OLLAMA_ERROR_MESSAGES['timeout']
+            
+        except requests.exceptions.ConnectionError:
+            logger.error("Cannot connect to Ollama service")
+            metrics.OLLAMA_ERRORS.inc(kind='connection')
+            yield None, OLLAMA_ERROR_MESSAGES['offline']
+            
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Ollama stream exception: {str(e)}")
+            metrics.OLLAMA_ERRORS.inc(kind='request')
+            yield None, OLLAMA_ERROR_MESSAGES['request']
+            
+        except GeneratorExit:
+            # The client went away (tab closed, stop button); not the backend's fault
+            stopped = True
+            raise
+            
+        except Exception as e:
+            logger.error(f"Unexpected error streaming from Ollama: {str(e)}")
+            metrics.OLLAMA_ERRORS.inc(kind='unexpected')
+            yield None, OLLAMA_ERROR_MESSAGES['unexpected']
+        
+        finally:
+            metrics.GENERATIONS_IN_FLIGHT.dec()
+            self.pool.release(backend, healthy or stopped)
+            self.scheduler.release()
+            # Streams are long by design; judge slowness by time to first token
+            self.breaker.record(healthy or stopped, first_token_time if first_token_time is not None else time.time() - start_time)
     
     def clean_response(self, response):
         if not response:
@@ -156,31 +540,188 @@ You are Accord, a helpful AI assistant.
 
 ai_service = AIService()
 
+def parse_rate_limit_policies(spec):
+    policies = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, limits = item.rpartition('=')
+        limit, _, window = limits.partition('/')
+        policies[name] = RateLimitPolicy(int(limit), int(window or RATE_LIMIT_WINDOW), RATE_LIMIT_ALGORITHM)
+    return policies
+
+def create_rate_limiter():
+    try:
+        backend = create_backend(RATE_LIMIT_BACKEND)
+    except Exception as e:
+        logger.error(f"Rate limit backend '{RATE_LIMIT_BACKEND}' unavailable, using per-process memory: {e}")
+        backend = MemoryBackend()
+    
+    return RateLimiter(
+        parse_rate_limit_policies(RATE_LIMIT_ROUTES),
+        RateLimitPolicy(RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW, RATE_LIMIT_ALGORITHM),
+        backend,
+        key_policies=parse_rate_limit_policies(RATE_LIMIT_KEYS)
+    )
+
+rate_limiter = create_rate_limiter()
+ollama_probe = BackendProbe(
+    ai_service.session, ai_service.pool.urls, ai_service.models.models, on_refresh=ai_service.models.ensure_resident
+)
+ai_service.models.start()
+ollama_probe.start()
+
+def collect_cache_metrics():
+    stats = ai_service.cache.stats()
+    metrics.CACHE_EVENTS.set_total(stats['hits'], result='hit')
+    metrics.CACHE_EVENTS.set_total(stats['misses'], result='miss')
+
+def collect_pool_metrics():
+    for backend in ai_service.pool.stats()['backends']:
+        metrics.BACKEND_OUTSTANDING.set(backend['outstanding'], backend=backend['url'])
+        metrics.BACKEND_AVAILABLE.set(int(backend['available']), backend=backend['url'])
+
+metrics.REGISTRY.add_collector(collect_cache_metrics)
+metrics.REGISTRY.add_collector(collect_pool_metrics)
+metrics.REGISTRY.add_collector(lambda: metrics.GENERATIONS_QUEUED.set(ai_service.scheduler.queue.size))
+
+def wants_stream(data):
+    return bool(data.get('stream')) or request.accept_mimetypes.best == 'text/event-stream'
+
+def sse_event(data, event=None):
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+def stream_ai_response(prompt, key, model, scheduling, prefix=None):
+    """Server-Sent Events response relaying tokens under the given JSON key."""
+    start_time = request.start_time
+    # Raise before the 200 is sent so an open breaker still becomes a 503
+    ai_service.breaker.check()
+    
+    def generate():
+        length = 0
+        details = {}
+        for chunk, error in ai_service.stream_ollama(prompt, model=model, prefix=prefix, details=details, **scheduling):
+            if error:
+                yield sse_event({key: error}, event='error')
+                return
+            length += len(chunk)
+            yield sse_event({key: chunk})
+        
+        yield sse_event({
+            'metadata': dict({
+                'response_time': round(time.time() - start_time, 2),
+                'response_length': length,
+                'model': model,
+                'timestamp': datetime.utcnow().isoformat()
+            }, **prompt_eval_metadata(details))
+        }, event='done')
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def prompt_eval_metadata(details):
+    """Ollama's prompt evaluation figures for response metadata (how much prefix reuse saved)."""
+    return {name: details.get(name) for name in ('prompt_eval_count', 'prompt_eval_ms', 'context_reused')}
+
+def rate_limit_key(remote_addr, headers):
+    if RATE_LIMIT_KEY_HEADER and headers.get(RATE_LIMIT_KEY_HEADER):
+        return headers.get(RATE_LIMIT_KEY_HEADER)
+    return remote_addr
+
+def scheduling_options(route, data, client_key):
+    """
+    Scheduler arguments for a generation: /ask is interactive and /analyze
+    bulk unless the body says otherwise; requests are shared fairly per
+    conversation (or per client when no conversation_id is sent). A
+    caller-supplied timeout_ms lets requests it has abandoned be dropped.
+    """
+    priority = data.get('priority')
+    if priority not in PRIORITIES:
+        priority = 'interactive' if route == '/ask' else 'bulk'
+    
+    timeout = data.get('timeout_ms')
+    return {
+        'priority': priority,
+        'tenant': str(data.get('conversation_id') or client_key),
+        'timeout': float(timeout) / 1000 if isinstance(timeout, (int, float)) and timeout > 0 else None
+    }
+
+def circuit_open_error(error):
+    return {
+        'error': 'AI backend unavailable',
+        'message': OLLAMA_ERROR_MESSAGES['unavailable'],
+        'retry_after': error.retry_after
+    }
+
+def queue_full_error():
+    return {
+        'error': 'Server busy',
+        'message': OLLAMA_ERROR_MESSAGES['busy'],
+        'retry_after': QUEUE_RETRY_AFTER
+    }
+
+def check_rate_limit(route, client_key):
+    """Counts a request against client_key's policy for route."""
+    decision = rate_limiter.hit(route, client_key)
+    if not decision.allowed:
+        logger.warning(f"Rate limit exceeded for {client_key} on {route}")
+        metrics.RATE_LIMITED.inc(route=route)
+    return decision
+
+def rate_limit_error(decision=None, route=None):
+    if decision is None:
+        policy = rate_limiter.policy_for(route)
+        return {
+            'error': 'Rate limit exceeded',
+            'message': f'Maximum {policy.limit} requests per {policy.window} seconds allowed',
+            'retry_after': policy.window
+        }
+    return {
+        'error': 'Rate limit exceeded',
+        'message': f'Maximum {decision.limit} requests per {decision.window} seconds allowed',
+        'retry_after': max(1, math.ceil(decision.retry_after))
+    }
+
+def rate_limit_headers(decision):
+    headers = {
+        'X-RateLimit-Limit': str(decision.limit),
+        'X-RateLimit-Remaining': str(decision.remaining),
+        'X-RateLimit-Reset': str(math.ceil(decision.reset_after))
+    }
+    if not decision.allowed:
+        headers['Retry-After'] = str(max(1, math.ceil(decision.retry_after)))
+    return headers
+
+def rate_limit_status(client_key):
+    routes = {}
+    for route in rate_limiter.policies:
+        policy = rate_limiter.policy_for(route, client_key)
+        decision = rate_limiter.peek(route, client_key)
+        routes[route] = {
+            'requests_used': policy.limit - decision.remaining,
+            'requests_allowed': policy.limit,
+            'window_seconds': policy.window,
+            'remaining_window_seconds': math.ceil(decision.reset_after),
+            'requests_remaining': decision.remaining,
+            'algorithm': policy.algorithm_name
+        }
+    
+    status = {'ip': client_key}
+    status.update(routes.get('/analyze', {}))
+    status['routes'] = routes
+    status['limiter'] = rate_limiter.stats()
+    return status
+
 def rate_limit(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        client_ip = request.remote_addr
-        current_time = time.time()
-        
-        with rate_lock:
-            for ip in list(rate_limit_data.keys()):
-                if current_time - rate_limit_data[ip]['start_time'] > RATE_LIMIT_WINDOW:
-                    del rate_limit_data[ip]
-            
-            if client_ip not in rate_limit_data:
-                rate_limit_data[client_ip] = {'count': 1, 'start_time': current_time}
-            else:
-                rate_limit_data[client_ip]['count'] += 1
-            
-            request_count = rate_limit_data[client_ip]['count']
-        
-        if request_count > RATE_LIMIT_REQUESTS:
-            logger.warning(f"Rate limit exceeded for IP: {client_ip}")
-            return jsonify({
-                'error': 'Rate limit exceeded',
-                'message': f'Maximum {RATE_LIMIT_REQUESTS} requests per minute allowed',
-                'retry_after': RATE_LIMIT_WINDOW
-            }), 429
+        route = request.url_rule.rule
+        decision = check_rate_limit(route, rate_limit_key(request.remote_addr, request.headers))
+        request.rate_limit = decision
+        if not decision.allowed:
+            return jsonify(rate_limit_error(decision, route)), 429
         
         return f(*args, **kwargs)
     return decorated_function
@@ -194,6 +735,11 @@ def after_request(response):
     if hasattr(request, 'start_time'):
         response_time = time.time() - request.start_time
         logger.info(f"Request {request.method} {request.path} completed in {response_time:.2f}s - Status: {response.status_code}")
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.REQUEST_LATENCY.observe(response_time, method=request.method, route=route, status=response.status_code)
+    
+    if hasattr(request, 'rate_limit'):
+        response.headers.update(rate_limit_headers(request.rate_limit))
     
     response.headers['X-Content-Type-Options'] = 'nosniff'
     response.headers['X-Frame-Options'] = 'DENY'
@@ -214,6 +760,7 @@ def analyze_chat():
         chat_data = data.get('chat_data', '')
         user_prompt = data.get('user_prompt', '')
         analysis_mode = data.get('analysis_mode', False)
+        conversation_id = data.get('conversation_id')
         
         if not user_prompt:
             return jsonify({'error': 'Missing user_prompt'}), 400
@@ -226,8 +773,17 @@ def analyze_chat():
         
         logger.info(f"AI Request - Prompt: {user_prompt[:80]}... | Chat history: {len(chat_data)} chars")
         
-        prompt = ai_service.generate_prompt(chat_data, user_prompt, analysis_mode)
-        ai_response, error = ai_service.call_ollama(prompt)
+        model = ai_service.models.model_for('analysis' if analysis_mode else 'chat')
+        prompt, prefix = ai_service.generate_prompt(chat_data, user_prompt, analysis_mode, conversation_id, model)
+        scheduling = scheduling_options('/analyze', data, rate_limit_key(request.remote_addr, request.headers))
+        
+        if wants_stream(data):
+            return stream_ai_response(prompt, 'response', model, scheduling, prefix)
+        
+        details = {}
+        ai_response, error = ai_service.call_ollama(
+            prompt, use_cache=data.get('cache', True), model=model, batch=True, prefix=prefix, details=details, **scheduling
+        )
         
         if error:
             return jsonify({'response': error})
@@ -238,13 +794,22 @@ def analyze_chat():
         
         return jsonify({
             'response': ai_response,
-            'metadata': {
+            'metadata': dict({
                 'response_time': round(response_time, 2),
                 'response_length': len(ai_response),
+                'model': model,
                 'timestamp': datetime.utcnow().isoformat()
-            }
+            }, **prompt_eval_metadata(details))
         })
         
+    except QueueFullError:
+        logger.warning("Generation queue full, rejecting request")
+        return jsonify(queue_full_error()), 503, {'Retry-After': str(QUEUE_RETRY_AFTER)}
+    
+    except CircuitOpenError as e:
+        logger.warning(f"Circuit open, failing fast (retry after {e.retry_after}s)")
+        return jsonify(circuit_open_error(e)), 503, {'Retry-After': str(e.retry_after)}
+    
     except Exception as e:
         logger.error(f"Unexpected error in /analyze: {str(e)}")
         return jsonify({
@@ -262,6 +827,7 @@ def ask_ai():
         history = data.get('history', '')
         question = data.get('question', '')
         analysis_mode = data.get('analysis_mode', False)
+        conversation_id = data.get('conversation_id')
         
         if not question:
             return jsonify({'error': 'Missing question'}), 400
@@ -269,42 +835,106 @@ def ask_ai():
         if len(question) > 1000:
             return jsonify({'error': 'Question too long (max 1000 characters)'}), 400
         
-        prompt = ai_service.generate_prompt(history, question, analysis_mode)
-        ai_response, error = ai_service.call_ollama(prompt)
+        model = ai_service.models.model_for('analysis' if analysis_mode else 'chat')
+        prompt, prefix = ai_service.generate_prompt(history, question, analysis_mode, conversation_id, model)
+        scheduling = scheduling_options('/ask', data, rate_limit_key(request.remote_addr, request.headers))
+        
+        if wants_stream(data):
+            return stream_ai_response(prompt, 'answer', model, scheduling, prefix)
+        
+        ai_response, error = ai_service.call_ollama(prompt, model=model, prefix=prefix, **scheduling)
         
         if error:
             return jsonify({'answer': error})
         
-        return jsonify({'answer': ai_response})
+        return jsonify({'answer': ai_response, 'model': model})
         
+    except QueueFullError:
+        logger.warning("Generation queue full, rejecting request")
+        return jsonify(queue_full_error()), 503, {'Retry-After': str(QUEUE_RETRY_AFTER)}
+    
+    except CircuitOpenError as e:
+        logger.warning(f"Circuit open, failing fast (retry after {e.retry_after}s)")
+        return jsonify(circuit_open_error(e)), 503, {'Retry-After': str(e.retry_after)}
+    
     except Exception as e:
         logger.error(f"Error in /ask: {str(e)}")
         return jsonify({'answer': "Service temporarily unavailable. Please try again."})
 
-@app.route('/health', methods=['GET'])
-def health_check():
-    health_data = {
-        'status': 'healthy',
+def health_status():
+    """Health summary built from the cached backend probe; never generates."""
+    backend = ollama_probe.snapshot()
+    breaker = ai_service.breaker.stats()
+    pool = ai_service.pool.stats()
+    healthy = (
+        backend['ready'] and backend['backends_ready'] == len(pool['backends'])
+        and breaker['state'] == 'closed' and pool['available'] == len(pool['backends'])
+    )
+    
+    return {
+        'status': 'healthy' if healthy else 'degraded',
         'timestamp': datetime.utcnow().isoformat(),
         'service': 'Accord AI Service',
         'version': '2.0.0',
         'rate_limits': {
             'requests_per_minute': RATE_LIMIT_REQUESTS,
-            'max_prompt_length': MAX_PROMPT_LENGTH,
+            # Prompts are limited in tokens now; this replaces the old max_prompt_length (characters)
+            'max_prompt_tokens': ai_service.budget.prompt_tokens,
             'max_response_length': MAX_RESPONSE_LENGTH
-        }
+        },
+        'prompt_budget': ai_service.budget.stats(),
+        'prompt_prefix': ai_service.prefixes.stats(),
+        'response_cache': ai_service.cache.stats(),
+        'coalesced_generations': ai_service.inflight.stats(),
+        'conversation_summaries': ai_service.summaries.stats(),
+        'models': ai_service.models.stats(),
+        'batching': ai_service.batcher.stats() if ai_service.batcher else None,
+        'generation_queue': ai_service.scheduler.stats(),
+        'circuit_breaker': breaker,
+        'backend_pool': pool,
+        'ollama_connected': backend['ollama_connected'],
+        'ollama_status': backend['ollama_status'],
+        'ollama_response_time': backend['ollama_response_time'],
+        'ollama_backend': backend
     }
+
+DEEP_HEALTH_PAYLOAD = {
+    "prompt": "Say OK",
+    "stream": False,
+    "options": {"num_predict": 5}
+}
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    return jsonify(health_status())
+
+@app.route('/health/live', methods=['GET'])
+def liveness():
+    return jsonify({
+        'status': 'alive',
+        'timestamp': datetime.utcnow().isoformat(),
+        'uptime_seconds': round(time.time() - START_TIME, 1)
+    })
+
+@app.route('/health/ready', methods=['GET'])
+def readiness():
+    backend = ollama_probe.snapshot()
+    return jsonify({
+        'status': 'ready' if backend['ready'] else 'not_ready',
+        'timestamp': datetime.utcnow().isoformat(),
+        'ollama_backend': backend
+    }), 200 if backend['ready'] else 503
+
+@app.route('/health/deep', methods=['GET'])
+@rate_limit
+def deep_health():
+    health_data = {'timestamp': datetime.utcnow().isoformat()}
     
     try:
-        test_payload = {
-            "model": "llama3:instruct",
-            "prompt": "Say OK",
-            "stream": False,
-            "options": {"num_predict": 5}
-        }
-        
         start_time = time.time()
-        response = requests.post(OLLAMA_API_URL, json=test_payload, timeout=5)
+        response = ai_service.session.post(
+            OLLAMA_API_URL, json=dict(DEEP_HEALTH_PAYLOAD, model=ai_service.model), timeout=(CONNECT_TIMEOUT, 5)
+        )
         response_time = time.time() - start_time
         
         health_data['ollama_connected'] = response.status_code == 200
@@ -318,7 +948,8 @@ def health_check():
             'ollama_response_time': None
         })
     
-    return jsonify(health_data)
+    health_data['status'] = 'healthy' if health_data['ollama_connected'] else 'unhealthy'
+    return jsonify(health_data), 200 if health_data['ollama_connected'] else 503
 
 @app.route('/status', methods=['GET'])
 def status():
@@ -328,16 +959,24 @@ def status():
         'timestamp': datetime.utcnow().isoformat()
     })
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/', methods=['GET'])
 def index():
     return jsonify({
         'service': 'Accord AI Service',
         'version': '2.0.0',
         'endpoints': {
-            '/analyze': 'POST - Main AI analysis endpoint (rate limited)',
-            '/ask': 'POST - Legacy AI endpoint (rate limited)',
-            '/health': 'GET - Health check',
-            '/status': 'GET - Simple status'
+            '/analyze': 'POST - Main AI analysis endpoint (rate limited, "stream": true for SSE)',
+            '/ask': 'POST - Legacy AI endpoint (rate limited, "stream": true for SSE)',
+            '/health': 'GET - Health summary (cached backend check)',
+            '/health/live': 'GET - Liveness (process only)',
+            '/health/ready': 'GET - Readiness (cached Ollama model check, 503 when not ready)',
+            '/health/deep': 'GET - On-demand test generation (rate limited)',
+            '/status': 'GET - Simple status',
+            '/metrics': 'GET - Prometheus metrics'
         },
         'rate_limits': {
             'requests_per_minute': RATE_LIMIT_REQUESTS,
@@ -347,26 +986,9 @@ def index():
 
 @app.route('/limits', methods=['GET'])
 def get_limits():
-    client_ip = request.remote_addr
-    current_time = time.time()
-    
-    with rate_lock:
-        if client_ip in rate_limit_data:
-            data = rate_limit_data[client_ip]
-            remaining_time = RATE_LIMIT_WINDOW - (current_time - data['start_time'])
-            requests_used = data['count']
-        else:
-            remaining_time = RATE_LIMIT_WINDOW
-            requests_used = 0
-    
-    return jsonify({
-        'ip': client_ip,
-        'requests_used': requests_used,
-        'requests_allowed': RATE_LIMIT_REQUESTS,
-        'window_seconds': RATE_LIMIT_WINDOW,
-        'remaining_window_seconds': max(0, round(remaining_time)),
-        'requests_remaining': max(0, RATE_LIMIT_REQUESTS - requests_used)
-    })
+    limits = rate_limit_status(rate_limit_key(request.remote_addr, request.headers))
+    limits['generation_queue'] = ai_service.scheduler.stats()
+    return jsonify(limits)
 
 # Error handlers
 @app.errorhandler(404)
@@ -379,11 +1001,7 @@ def method_not_allowed(error):
 
 @app.errorhandler(429)
 def rate_limit_exceeded(error):
-    return jsonify({
-        'error': 'Rate limit exceeded',
-        'message': f'Maximum {RATE_LIMIT_REQUESTS} requests per minute allowed',
-        'retry_after': RATE_LIMIT_WINDOW
-    }), 429
+    return jsonify(rate_limit_error()), 429
 
 @app.errorhandler(500)
 def internal_error(error):
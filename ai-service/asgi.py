@@ -0,0 +1,601 @@
+# asgi.py - Async serving mode for the Accord AI Service
+# Same routes as app.py, but Ollama calls are awaited instead of holding a
+# worker thread. Run with: uvicorn asgi:app --port 5001
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+
+from singleflight import AsyncSingleFlight, SingleFlightTimeout
+from batching import AsyncMicroBatcher, BATCH_WINDOW_MS
+from scheduler import AsyncGenerationScheduler, QueueFullError, DeadlineExceeded, QUEUE_RETRY_AFTER
+from breaker import CircuitOpenError
+import metrics
+
+from app import (
+    ai_service,
+    StreamCleaner,
+    check_rate_limit,
+    rate_limiter,
+    rate_limit_error,
+    rate_limit_headers,
+    rate_limit_key,
+    rate_limit_status,
+    scheduling_options,
+    queue_full_error,
+    circuit_open_error,
+    sse_event,
+    prompt_eval_metadata,
+    health_status,
+    ollama_probe,
+    DEEP_HEALTH_PAYLOAD,
+    START_TIME,
+    OLLAMA_API_URL,
+    OLLAMA_ERROR_MESSAGES,
+    OLLAMA_POOL_SIZE,
+    OLLAMA_CONNECT_RETRIES,
+    CONNECT_TIMEOUT,
+    REQUEST_TIMEOUT,
+    SINGLE_FLIGHT_WAIT_TIMEOUT,
+    MAX_RESPONSE_LENGTH,
+    RATE_LIMIT_REQUESTS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncAIService:
+    """
+    Awaitable counterpart of AIService.call_ollama / stream_ollama. Prompt
+    building and response cleaning are delegated to the shared AIService.
+    """
+    def __init__(self, service, scheduler):
+        self.service = service
+        self.scheduler = scheduler
+        # Same backend, so the same breaker as the threaded service
+        self.breaker = service.breaker
+        self.client = None
+        self.inflight = AsyncSingleFlight()
+        self.batcher = AsyncMicroBatcher(self.generate) if BATCH_WINDOW_MS > 0 else None
+
+    async def start(self):
+        transport = httpx.AsyncHTTPTransport(retries=OLLAMA_CONNECT_RETRIES)
+        self.client = httpx.AsyncClient(
+            transport=transport,
+            limits=httpx.Limits(max_connections=OLLAMA_POOL_SIZE, max_keepalive_connections=OLLAMA_POOL_SIZE),
+            timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT)
+        )
+
+    async def close(self):
+        if self.batcher:
+            await self.batcher.stop()
+        if self.client:
+            await self.client.aclose()
+
+    async def call_ollama(self, prompt, scheduling, use_cache=False, model=None, batch=False, prefix=None, details=None):
+        """
+        scheduling holds the scheduler arguments (priority, tenant, timeout);
+        QueueFullError, DeadlineExceeded and CircuitOpenError propagate.
+        """
+        details = {} if details is None else details
+        affinity = scheduling['tenant']
+        payload = self.service.build_payload(prompt, model=model, context=prefix.context if prefix else None)
+        key = self.service.payload_cache_key(payload)
+
+        if use_cache:
+            cached = self.service.cache.get(key)
+            if cached is not None:
+                logger.info("Ollama response served from cache")
+                return cached, None
+
+        if batch and self.batcher:
+            generate = lambda: self.batcher.submit(payload, affinity=affinity, details=details)
+        else:
+            generate = lambda: self.generate(payload, affinity=affinity, details=details)
+
+        async def run():
+            # Only the shared call holds a slot; coalesced waiters just wait for its result
+            await self.scheduler.acquire(**scheduling)
+            try:
+                self.breaker.allow()
+                return await generate()
+            finally:
+                self.scheduler.release()
+
+        try:
+            ai_response, error = await self.inflight.do(key, run, timeout=SINGLE_FLIGHT_WAIT_TIMEOUT)
+        except SingleFlightTimeout:
+            logger.warning("Timed out waiting for shared Ollama generation")
+            metrics.OLLAMA_ERRORS.inc(kind='timeout')
+            return None, OLLAMA_ERROR_MESSAGES['timeout']
+
+        if use_cache and not error:
+            self.service.cache.set(key, ai_response)
+        if not error:
+            self.service.remember_context(prefix, payload["model"], details)
+
+        return ai_response, error
+
+    async def generate(self, payload, affinity=None, details=None):
+        backend = self.service.pool.acquire(affinity)
+        metrics.GENERATIONS_IN_FLIGHT.inc()
+        start_time = time.time()
+        healthy = False
+        try:
+            response = await self.client.post(self.service.generate_url(backend), json=payload)
+            response_time = time.time() - start_time
+
+            logger.info(f"Ollama response time: {response_time:.2f}s")
+
+            if response.status_code != 200:
+                logger.error(f"Ollama API error: {response.status_code}")
+                metrics.OLLAMA_ERRORS.inc(kind='http_status')
+                healthy = response.status_code < 500
+                return None, OLLAMA_ERROR_MESSAGES['unavailable']
+
+            response_data = response.json()
+            metrics.observe_ollama_response(
+                response_data, payload["model"], 'blocking', response_time, context_reused=bool(payload.get("context"))
+            )
+            self.service.record_details(details, response_data, payload)
+            ai_response = self.service.clean_response(response_data.get("response", "").strip())
+            healthy = True
+            return ai_response, None
+
+        except httpx.TimeoutException:
+            logger.warning("Ollama request timeout")
+            metrics.OLLAMA_ERRORS.inc(kind='timeout')
+            return None, OLLAMA_ERROR_MESSAGES['timeout']
+
+        except httpx.ConnectError:
+            logger.error("Cannot connect to Ollama service")
+            metrics.OLLAMA_ERRORS.inc(kind='connection')
+            return None, OLLAMA_ERROR_MESSAGES['offline']
+
+        except httpx.HTTPError as e:
+            logger.error(f"Ollama request exception: {str(e)}")
+            metrics.OLLAMA_ERRORS.inc(kind='request')
+            return None, OLLAMA_ERROR_MESSAGES['request']
+
+        except Exception as e:
+            logger.error(f"Unexpected error calling Ollama: {str(e)}")
+            metrics.OLLAMA_ERRORS.inc(kind='unexpected')
+            return None, OLLAMA_ERROR_MESSAGES['unexpected']
+
+        finally:
+            metrics.GENERATIONS_IN_FLIGHT.dec()
+            self.service.pool.release(backend, healthy)
+            self.breaker.record(healthy, time.time() - start_time)
+
+    async def stream_ollama(self, prompt, model=None, affinity=None, prefix=None, details=None):
+        details = {} if details is None else details
+        payload = self.service.build_payload(prompt, stream=True, model=model, context=prefix.context if prefix else None)
+        cleaner = StreamCleaner(MAX_RESPONSE_LENGTH)
+
+        try:
+            self.breaker.allow()
+        except CircuitOpenError:
+            yield None, OLLAMA_ERROR_MESSAGES['unavailable']
+            return
+
+        backend = self.service.pool.acquire(affinity)
+        metrics.GENERATIONS_IN_FLIGHT.inc()
+        start_time = time.time()
+        first_token_time = None
+        healthy = False
+        stopped = False  # the consumer closed the stream before it ended
+        try:
+            data = {}
+
+            async with self.client.stream("POST", self.service.generate_url(backend), json=payload) as response:
+                if response.status_code != 200:
+                    logger.error(f"Ollama API error: {response.status_code}")
+                    metrics.OLLAMA_ERRORS.inc(kind='http_status')
+                    healthy = response.status_code < 500
+                    yield None, OLLAMA_ERROR_MESSAGES['unavailable']
+                    return
+
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+
+                    data = json.loads(line)
+                    if data.get("error"):
+                        logger.error(f"Ollama stream error: {data['error']}")
+                        metrics.OLLAMA_ERRORS.inc(kind='stream')
+                        yield None, OLLAMA_ERROR_MESSAGES['request']
+                        return
+
+                    chunk = cleaner.feed(data.get("response", ""))
+                    if chunk:
+                        if first_token_time is None:
+                            first_token_time = time.time() - start_time
+                            logger.info(f"Ollama first token in {first_token_time:.2f}s")
+                        yield chunk, None
+
+                    if cleaner.exhausted or data.get("done"):
+                        break
+
+            healthy = True
+            chunk = cleaner.finish()
+            if chunk:
+                yield chunk, None
+
+            total_time = time.time() - start_time
+            metrics.observe_ollama_response(
+                data, payload["model"], 'stream', total_time, first_token_time, context_reused=bool(payload.get("context"))
+            )
+            logger.info(f"Ollama stream completed in {total_time:.2f}s - Length: {cleaner.length}")
+            if data.get("done"):
+                self.service.record_details(details, data, payload)
+                self.service.remember_context(prefix, payload["model"], details)
+
+        except httpx.TimeoutException:
+            logger.warning("Ollama stream timeout")
+            metrics.OLLAMA_ERRORS.inc(kind='timeout')
+            yield None, OLLAMA_ERROR_MESSAGES['timeout']
+
+        except httpx.ConnectError:
+            logger.error("Cannot connect to Ollama service")
+            metrics.OLLAMA_ERRORS.inc(kind='connection')
+            yield None, OLLAMA_ERROR_MESSAGES['offline']
+
+        except httpx.HTTPError as e:
+            logger.error(f"Ollama stream exception: {str(e)}")
+            metrics.OLLAMA_ERRORS.inc(kind='request')
+            yield None, OLLAMA_ERROR_MESSAGES['request']
+
+        except (GeneratorExit, asyncio.CancelledError):
+            # The client went away (tab closed, stop button); not the backend's fault
+            stopped = True
+            raise
+
+        except Exception as e:
+            logger.error(f"Unexpected error streaming from Ollama: {str(e)}")
+            metrics.OLLAMA_ERRORS.inc(kind='unexpected')
+            yield None, OLLAMA_ERROR_MESSAGES['unexpected']
+
+        finally:
+            metrics.GENERATIONS_IN_FLIGHT.dec()
+            self.service.pool.release(backend, healthy or stopped)
+            self.breaker.record(healthy or stopped, first_token_time if first_token_time is not None else time.time() - start_time)
+
+
+scheduler = AsyncGenerationScheduler()
+async_ai_service = AsyncAIService(ai_service, scheduler)
+metrics.REGISTRY.add_collector(lambda: metrics.GENERATIONS_QUEUED.set(scheduler.queue.size))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await async_ai_service.start()
+    ollama_probe.start()
+    yield
+    await async_ai_service.close()
+
+
+app = FastAPI(title="Accord AI Service", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def log_requests(request: Request, call_next):
+    request.state.start_time = time.time()
+    response = await call_next(request)
+
+    response_time = time.time() - request.state.start_time
+    logger.info(f"Request {request.method} {request.url.path} completed in {response_time:.2f}s - Status: {response.status_code}")
+    route = request.scope.get('route')
+    metrics.REQUEST_LATENCY.observe(
+        response_time, method=request.method, route=route.path if route else 'unmatched', status=response.status_code
+    )
+
+    if hasattr(request.state, 'rate_limit'):
+        response.headers.update(rate_limit_headers(request.state.rate_limit))
+
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['X-Frame-Options'] = 'DENY'
+    return response
+
+
+async def hit_rate_limit(route, request: Request):
+    """check_rate_limit for an ASGI request; shared backends (SQLite, Redis) block, so they run off the loop."""
+    client_key = rate_limit_key(request.client.host, request.headers)
+    if rate_limiter.backend.name == 'memory':
+        return check_rate_limit(route, client_key)
+    return await asyncio.to_thread(check_rate_limit, route, client_key)
+
+
+def queue_full_response():
+    return JSONResponse(queue_full_error(), status_code=503, headers={'Retry-After': str(QUEUE_RETRY_AFTER)})
+
+
+def circuit_open_response(error):
+    logger.warning(f"Circuit open, failing fast (retry after {error.retry_after}s)")
+    return JSONResponse(circuit_open_error(error), status_code=503, headers={'Retry-After': str(error.retry_after)})
+
+
+async def read_json(request: Request):
+    if 'application/json' not in request.headers.get('content-type', ''):
+        return None
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+def wants_stream(request: Request, data):
+    return bool(data.get('stream')) or 'text/event-stream' in request.headers.get('accept', '')
+
+
+async def generate(request: Request, prompt, key, model, scheduling, use_cache=False, batch=False, prefix=None, details=None):
+    """Runs one generation inside a scheduler slot, as JSON or as SSE."""
+    details = {} if details is None else details
+    try:
+        # Don't queue for a backend the breaker already knows is down
+        async_ai_service.breaker.check()
+        if not wants_stream(request, request.state.data):
+            # call_ollama takes the slot itself, so identical prompts share one
+            return await async_ai_service.call_ollama(
+                prompt, scheduling, use_cache=use_cache, model=model, batch=batch, prefix=prefix, details=details
+            ), None
+        # Streams are never coalesced; each holds its own slot
+        await scheduler.acquire(**scheduling)
+    except CircuitOpenError as e:
+        return None, circuit_open_response(e)
+    except QueueFullError:
+        logger.warning("Generation queue full, rejecting request")
+        return None, queue_full_response()
+    except DeadlineExceeded:
+        logger.warning(f"Dropped {scheduling['priority']} request for {scheduling['tenant']}: no backend slot before its deadline")
+        return (None, OLLAMA_ERROR_MESSAGES['timeout']), None
+
+    start_time = request.state.start_time
+
+    async def events():
+        length = 0
+        try:
+            async for chunk, error in async_ai_service.stream_ollama(
+                prompt, model=model, affinity=scheduling['tenant'], prefix=prefix, details=details
+            ):
+                if error:
+                    yield sse_event({key: error}, event='error')
+                    return
+                length += len(chunk)
+                yield sse_event({key: chunk})
+
+            yield sse_event({
+                'metadata': dict({
+                    'response_time': round(time.time() - start_time, 2),
+                    'response_length': length,
+                    'model': model,
+                    'timestamp': datetime.utcnow().isoformat()
+                }, **prompt_eval_metadata(details))
+            }, event='done')
+        finally:
+            scheduler.release()
+
+    return None, StreamingResponse(
+        events(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.post('/analyze')
+async def analyze_chat(request: Request):
+    decision = await hit_rate_limit('/analyze', request)
+    request.state.rate_limit = decision
+    if not decision.allowed:
+        return JSONResponse(rate_limit_error(decision, '/analyze'), status_code=429)
+
+    try:
+        data = await read_json(request)
+        if data is None:
+            return JSONResponse({'error': 'Request must be JSON'}, status_code=400)
+        if not data:
+            return JSONResponse({'error': 'No JSON data provided'}, status_code=400)
+        request.state.data = data
+
+        chat_data = data.get('chat_data', '')
+        user_prompt = data.get('user_prompt', '')
+        analysis_mode = data.get('analysis_mode', False)
+        conversation_id = data.get('conversation_id')
+
+        if not user_prompt:
+            return JSONResponse({'error': 'Missing user_prompt'}, status_code=400)
+
+        if len(user_prompt) > 1000:
+            return JSONResponse({'error': 'User prompt too long (max 1000 characters)'}, status_code=400)
+
+        if len(chat_data) > 10000:
+            return JSONResponse({'error': 'Chat history too long (max 10000 characters)'}, status_code=400)
+
+        logger.info(f"AI Request - Prompt: {user_prompt[:80]}... | Chat history: {len(chat_data)} chars")
+
+        model = ai_service.models.model_for('analysis' if analysis_mode else 'chat')
+        prompt, prefix = ai_service.generate_prompt(chat_data, user_prompt, analysis_mode, conversation_id, model)
+        scheduling = scheduling_options('/analyze', data, rate_limit_key(request.client.host, request.headers))
+        details = {}
+        result, response = await generate(
+            request, prompt, 'response', model, scheduling, use_cache=data.get('cache', True), batch=True,
+            prefix=prefix, details=details
+        )
+        if response is not None:
+            return response
+
+        ai_response, error = result
+        if error:
+            return {'response': error}
+
+        response_time = time.time() - request.state.start_time
+
+        logger.info(f"AI Response generated in {response_time:.2f}s - Length: {len(ai_response)}")
+
+        return {
+            'response': ai_response,
+            'metadata': dict({
+                'response_time': round(response_time, 2),
+                'response_length': len(ai_response),
+                'model': model,
+                'timestamp': datetime.utcnow().isoformat()
+            }, **prompt_eval_metadata(details))
+        }
+
+    except Exception as e:
+        logger.error(f"Unexpected error in /analyze: {str(e)}")
+        return JSONResponse({
+            'response': "Service temporarily unavailable. Please try again."
+        }, status_code=500)
+
+
+@app.post('/ask')
+async def ask_ai(request: Request):
+    decision = await hit_rate_limit('/ask', request)
+    request.state.rate_limit = decision
+    if not decision.allowed:
+        return JSONResponse(rate_limit_error(decision, '/ask'), status_code=429)
+
+    try:
+        data = await read_json(request)
+        if data is None:
+            return JSONResponse({'error': 'Request must be JSON'}, status_code=400)
+        request.state.data = data
+
+        history = data.get('history', '')
+        question = data.get('question', '')
+        analysis_mode = data.get('analysis_mode', False)
+        conversation_id = data.get('conversation_id')
+
+        if not question:
+            return JSONResponse({'error': 'Missing question'}, status_code=400)
+
+        if len(question) > 1000:
+            return JSONResponse({'error': 'Question too long (max 1000 characters)'}, status_code=400)
+
+        model = ai_service.models.model_for('analysis' if analysis_mode else 'chat')
+        prompt, prefix = ai_service.generate_prompt(history, question, analysis_mode, conversation_id, model)
+        scheduling = scheduling_options('/ask', data, rate_limit_key(request.client.host, request.headers))
+        result, response = await generate(request, prompt, 'answer', model, scheduling, prefix=prefix)
+        if response is not None:
+            return response
+
+        ai_response, error = result
+        if error:
+            return {'answer': error}
+
+        return {'answer': ai_response, 'model': model}
+
+    except Exception as e:
+        logger.error(f"Error in /ask: {str(e)}")
+        return {'answer': "Service temporarily unavailable. Please try again."}
+
+
+@app.get('/health')
+async def health_check():
+    health_data = await asyncio.to_thread(health_status)
+    health_data['generation_queue'] = scheduler.stats()
+    health_data['coalesced_generations'] = async_ai_service.inflight.stats()
+    health_data['batching'] = async_ai_service.batcher.stats() if async_ai_service.batcher else None
+    return health_data
+
+
+@app.get('/health/live')
+async def liveness():
+    return {
+        'status': 'alive',
+        'timestamp': datetime.utcnow().isoformat(),
+        'uptime_seconds': round(time.time() - START_TIME, 1)
+    }
+
+
+@app.get('/health/ready')
+async def readiness():
+    backend = await asyncio.to_thread(ollama_probe.snapshot)
+    return JSONResponse({
+        'status': 'ready' if backend['ready'] else 'not_ready',
+        'timestamp': datetime.utcnow().isoformat(),
+        'ollama_backend': backend
+    }, status_code=200 if backend['ready'] else 503)
+
+
+@app.get('/health/deep')
+async def deep_health(request: Request):
+    decision = await hit_rate_limit('/health/deep', request)
+    request.state.rate_limit = decision
+    if not decision.allowed:
+        return JSONResponse(rate_limit_error(decision, '/health/deep'), status_code=429)
+
+    health_data = {'timestamp': datetime.utcnow().isoformat()}
+
+    try:
+        start_time = time.time()
+        response = await async_ai_service.client.post(
+            OLLAMA_API_URL,
+            json=dict(DEEP_HEALTH_PAYLOAD, model=ai_service.model),
+            timeout=httpx.Timeout(5, connect=CONNECT_TIMEOUT)
+        )
+        response_time = time.time() - start_time
+
+        health_data['ollama_connected'] = response.status_code == 200
+        health_data['ollama_response_time'] = round(response_time, 2)
+        health_data['ollama_status'] = 'connected' if health_data['ollama_connected'] else 'disconnected'
+
+    except Exception as e:
+        health_data.update({
+            'ollama_connected': False,
+            'ollama_status': f'error: {str(e)}',
+            'ollama_response_time': None
+        })
+
+    health_data['status'] = 'healthy' if health_data['ollama_connected'] else 'unhealthy'
+    return JSONResponse(health_data, status_code=200 if health_data['ollama_connected'] else 503)
+
+
+@app.get('/status')
+async def status():
+    return {
+        'status': 'ok',
+        'service': 'Accord AI',
+        'timestamp': datetime.utcnow().isoformat()
+    }
+
+
+@app.get('/metrics')
+async def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get('/')
+async def index():
+    return {
+        'service': 'Accord AI Service',
+        'version': '2.0.0',
+        'mode': 'asgi',
+        'endpoints': {
+            '/analyze': 'POST - Main AI analysis endpoint (rate limited, "stream": true for SSE)',
+            '/ask': 'POST - Legacy AI endpoint (rate limited, "stream": true for SSE)',
+            '/health': 'GET - Health summary (cached backend check)',
+            '/health/live': 'GET - Liveness (process only)',
+            '/health/ready': 'GET - Readiness (cached Ollama model check, 503 when not ready)',
+            '/health/deep': 'GET - On-demand test generation (rate limited)',
+            '/status': 'GET - Simple status',
+            '/metrics': 'GET - Prometheus metrics'
+        },
+        'rate_limits': {
+            'requests_per_minute': RATE_LIMIT_REQUESTS,
+            'max_request_size': '10KB'
+        }
+    }
+
+
+@app.get('/limits')
+async def get_limits(request: Request):
+    limits = await asyncio.to_thread(rate_limit_status, rate_limit_key(request.client.host, request.headers))
+    limits['generation_queue'] = scheduler.stats()
+    return limits
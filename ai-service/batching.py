@@ -0,0 +1,187 @@
+# batching.py - Micro-batching of concurrent generation requests
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Collect requests arriving within this window. Off by default (0), in which
+# case no batcher is created and /health reports batching as null: Ollama has
+# no batch API, so the scheduler's slots already feed its parallel decoding
+# and a window only adds latency. Only worth enabling in front of a backend
+# that does batch (e.g. an OpenAI-compatible server with continuous batching).
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", 0))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 8))
+
+BATCH_SIZE = metrics.REGISTRY.histogram(
+    "accord_batch_size", "Requests dispatched together per batch.", buckets=(1, 2, 3, 4, 6, 8, 12, 16, 32))
+BATCH_WAIT = metrics.REGISTRY.histogram(
+    "accord_batch_wait_seconds", "Time a batch stayed open collecting requests.",
+    buckets=(0.001, 0.005, 0.01, 0.02, 0.03, 0.05, 0.1, 0.25))
+BATCH_QUEUE_TIME = metrics.REGISTRY.histogram(
+    "accord_batch_queue_seconds", "Time from enqueue until a request was sent to the backend.")
+
+
+class _Item:
+    def __init__(self, payload, future, options):
+        self.payload = payload
+        self.future = future
+        self.options = options
+        self.enqueued = time.time()
+
+
+class MicroBatcher:
+    """
+    Groups requests that arrive within window_ms (up to max_size) and sends
+    each group to the backend at once over parallel slots. Results are
+    delivered back to each caller's future. Callers already hold a scheduler
+    slot, so slots should equal the scheduler's and never limit on its own.
+    """
+    def __init__(self, run, slots, window_ms=BATCH_WINDOW_MS, max_size=BATCH_MAX_SIZE):
+        self.run = run
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self.queue = queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=slots, thread_name_prefix="batch-slot")
+        self.thread = None
+        self.lock = threading.Lock()
+        self.batches = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._dispatch_loop, name="batcher", daemon=True)
+                self.thread.start()
+
+    def submit(self, payload, **options):
+        """
+        Blocks until the backend result for payload is available; options are
+        passed to run. There is no timeout here: run is bounded by the HTTP
+        timeouts, and returning early would free the caller's scheduler slot
+        while the generation still occupies the backend.
+        """
+        self.start()
+        item = _Item(payload, Future(), options)
+        self.queue.put(item)
+        return item.future.result()
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        opened = time.time()
+        deadline = opened + self.window
+        while len(batch) < self.max_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        BATCH_WAIT.observe(time.time() - opened)
+        return batch
+
+    def _dispatch_loop(self):
+        while True:
+            batch = self._collect()
+            self.batches += 1
+            BATCH_SIZE.observe(len(batch))
+            logger.debug(f"Dispatching batch of {len(batch)} requests")
+            now = time.time()
+            for item in batch:
+                BATCH_QUEUE_TIME.observe(now - item.enqueued)
+                self.executor.submit(self._execute, item)
+
+    def _execute(self, item):
+        try:
+            item.future.set_result(self.run(item.payload, **item.options))
+        except Exception as e:
+            item.future.set_exception(e)
+
+    def stats(self):
+        return {
+            'window_ms': self.window * 1000,
+            'max_batch_size': self.max_size,
+            'queued': self.queue.qsize(),
+            'batches': self.batches
+        }
+
+
+class AsyncMicroBatcher:
+    """asyncio flavour of MicroBatcher; run is a coroutine function."""
+    def __init__(self, run, window_ms=BATCH_WINDOW_MS, max_size=BATCH_MAX_SIZE):
+        self.run = run
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self.queue = None
+        self.task = None
+        # The loop only keeps weak references to tasks; hold dispatched ones until done
+        self.tasks = set()
+        self.batches = 0
+
+    def start(self):
+        if self.task is None:
+            self.queue = asyncio.Queue()
+            self.task = asyncio.ensure_future(self._dispatch_loop())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        for task in list(self.tasks):
+            task.cancel()
+
+    async def submit(self, payload, **options):
+        self.start()
+        item = _Item(payload, asyncio.get_running_loop().create_future(), options)
+        await self.queue.put(item)
+        return await item.future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        opened = loop.time()
+        while len(batch) < self.max_size:
+            remaining = opened + self.window - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        BATCH_WAIT.observe(loop.time() - opened)
+        return batch
+
+    async def _dispatch_loop(self):
+        while True:
+            batch = await self._collect()
+            self.batches += 1
+            BATCH_SIZE.observe(len(batch))
+            now = time.time()
+            for item in batch:
+                BATCH_QUEUE_TIME.observe(now - item.enqueued)
+                task = asyncio.ensure_future(self._execute(item))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+    async def _execute(self, item):
+        try:
+            result = await self.run(item.payload, **item.options)
+            if not item.future.done():
+                item.future.set_result(result)
+        except Exception as e:
+            if not item.future.done():
+                item.future.set_exception(e)
+
+    def stats(self):
+        return {
+            'window_ms': self.window * 1000,
+            'max_batch_size': self.max_size,
+            'queued': self.queue.qsize() if self.queue else 0,
+            'batches': self.batches
+        }
@@ -0,0 +1,163 @@
+# breaker.py - Circuit breaker around the Ollama backend
+import collections
+import logging
+import math
+import os
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Trip when at least BREAKER_MIN_CALLS calls in the window and either rate is exceeded
+BREAKER_WINDOW = float(os.getenv("BREAKER_WINDOW", 60))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", 5))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", 0.5))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", 60))
+BREAKER_SLOW_CALL_RATE = float(os.getenv("BREAKER_SLOW_CALL_RATE", 0.8))
+# How long to fail fast before letting probe requests through
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", 30))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", 1))
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = metrics.REGISTRY.gauge(
+    "accord_circuit_breaker_state", "Ollama circuit breaker state (0 closed, 1 half-open, 2 open).")
+BREAKER_TRANSITIONS = metrics.REGISTRY.counter(
+    "accord_circuit_breaker_transitions_total", "Circuit breaker state changes by new state.", ("state",))
+BREAKER_REJECTED = metrics.REGISTRY.counter(
+    "accord_circuit_breaker_rejected_total", "Calls failed fast while the breaker was open.")
+
+BREAKER_STATE.set(0)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Circuit open, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Closed: calls pass and their outcomes are tracked over a rolling window.
+    Open: calls fail immediately until open_seconds have passed.
+    Half-open: up to half_open_probes calls are let through; that many
+    successes close the breaker, any failure opens it again.
+    """
+    def __init__(self, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS, failure_rate=BREAKER_FAILURE_RATE,
+                 slow_call_seconds=BREAKER_SLOW_CALL_SECONDS, slow_call_rate=BREAKER_SLOW_CALL_RATE,
+                 open_seconds=BREAKER_OPEN_SECONDS, half_open_probes=BREAKER_HALF_OPEN_PROBES):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.calls = collections.deque()  # (finished_at, failed, slow)
+        self.probes_started = 0
+        self.probe_successes = 0
+        self.probe_window_started = 0.0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def _transition(self, state, now):
+        if state == self.state:
+            return
+        logger.warning(f"Ollama circuit breaker {self.state} -> {state}")
+        self.state = state
+        if state == OPEN:
+            self.opened_at = now
+        if state == HALF_OPEN:
+            self.probes_started = 0
+            self.probe_successes = 0
+            self.probe_window_started = now
+        if state == CLOSED:
+            self.calls.clear()
+        BREAKER_STATE.set(STATE_VALUES[state])
+        BREAKER_TRANSITIONS.inc(state=state)
+
+    def _retry_after(self, now):
+        return max(1, math.ceil(self.opened_at + self.open_seconds - now))
+
+    def _reject(self, now):
+        self.rejected += 1
+        BREAKER_REJECTED.inc()
+        raise CircuitOpenError(self._retry_after(now) if self.state == OPEN else 1)
+
+    def _refresh(self, now):
+        if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN, now)
+        elif self.state == HALF_OPEN and now - self.probe_window_started >= self.open_seconds:
+            # Probes that never reported back (caller gone) must not wedge the breaker
+            self.probes_started = self.probe_successes
+            self.probe_window_started = now
+
+    def check(self):
+        """Raises CircuitOpenError while open; reserves nothing."""
+        now = time.time()
+        with self.lock:
+            self._refresh(now)
+            if self.state == OPEN:
+                self._reject(now)
+
+    def allow(self):
+        """Raises CircuitOpenError unless a call may go to the backend now."""
+        now = time.time()
+        with self.lock:
+            self._refresh(now)
+            if self.state == OPEN:
+                self._reject(now)
+            if self.state == HALF_OPEN:
+                if self.probes_started >= self.half_open_probes:
+                    self._reject(now)
+                self.probes_started += 1
+
+    def record(self, success, elapsed):
+        now = time.time()
+        slow = elapsed >= self.slow_call_seconds
+        with self.lock:
+            if self.state == HALF_OPEN:
+                if not success or slow:
+                    self._transition(OPEN, now)
+                else:
+                    self.probe_successes += 1
+                    if self.probe_successes >= self.half_open_probes:
+                        self._transition(CLOSED, now)
+                return
+            if self.state == OPEN:
+                return
+
+            self.calls.append((now, not success, slow))
+            while self.calls and self.calls[0][0] < now - self.window:
+                self.calls.popleft()
+
+            total = len(self.calls)
+            if total < self.min_calls:
+                return
+            failures = sum(1 for _, failed, _ in self.calls if failed)
+            slow_calls = sum(1 for _, _, was_slow in self.calls if was_slow)
+            if failures / total >= self.failure_rate or slow_calls / total >= self.slow_call_rate:
+                logger.error(f"Tripping circuit breaker: {failures}/{total} failed, {slow_calls}/{total} slow")
+                self._transition(OPEN, now)
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            self._refresh(now)
+            total = len(self.calls)
+            return {
+                'state': self.state,
+                'window_calls': total,
+                'window_failures': sum(1 for _, failed, _ in self.calls if failed),
+                'window_slow_calls': sum(1 for _, _, slow in self.calls if slow),
+                'retry_after': self._retry_after(now) if self.state == OPEN else 0,
+                'rejected_calls': self.rejected,
+                'failure_rate_threshold': self.failure_rate,
+                'slow_call_seconds': self.slow_call_seconds,
+                'open_seconds': self.open_seconds
+            }
@@ -0,0 +1,159 @@
+# cache.py - Response cache for identical Ollama generations
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 3600))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH")  # e.g. "cache/responses.db"; unset = memory only
+
+
+def normalize_prompt(prompt):
+    return re.sub(r'\s+', ' ', prompt).strip()
+
+
+def cache_key(model, prompt, options):
+    material = json.dumps({
+        'model': model,
+        'prompt': normalize_prompt(prompt),
+        'options': options or {}
+    }, sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class DiskCache:
+    """SQLite-backed store so cached responses survive restarts."""
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def get(self, key):
+        return self.conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+
+    def set(self, key, value, created):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (key, value, created) VALUES (?, ?, ?)",
+            (key, value, created)
+        )
+        self.conn.commit()
+
+    def delete(self, key):
+        self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+        self.conn.commit()
+
+    def purge(self, older_than):
+        deleted = self.conn.execute("DELETE FROM responses WHERE created < ?", (older_than,)).rowcount
+        self.conn.commit()
+        return deleted
+
+
+class ResponseCache:
+    """
+    In-memory LRU of generated responses bounded by total size in bytes,
+    with a TTL and an optional DiskCache behind it.
+    """
+    def __init__(self, ttl=RESPONSE_CACHE_TTL, max_bytes=RESPONSE_CACHE_MAX_BYTES, path=RESPONSE_CACHE_PATH):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.disk = None
+
+        if path:
+            try:
+                self.disk = DiskCache(path)
+                purged = self.disk.purge(time.time() - ttl)
+                logger.info(f"Response cache persisted at {path} ({purged} expired entries purged)")
+            except sqlite3.Error as e:
+                logger.error(f"Could not open response cache at {path}: {e}")
+
+    def get(self, key):
+        now = time.time()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and now - entry[1] <= self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry:
+                self._remove(key)
+
+            if self.disk:
+                try:
+                    row = self.disk.get(key)
+                    if row and now - row[1] <= self.ttl:
+                        self._store(key, row[0], row[1])
+                        self.hits += 1
+                        return row[0]
+                    if row:
+                        self.disk.delete(key)
+                except sqlite3.Error as e:
+                    logger.error(f"Response cache read failed: {e}")
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        now = time.time()
+
+        with self.lock:
+            self._store(key, value, now)
+            if self.disk:
+                try:
+                    self.disk.set(key, value, now)
+                except sqlite3.Error as e:
+                    logger.error(f"Response cache write failed: {e}")
+
+    def _store(self, key, value, created):
+        if key in self.entries:
+            self._remove(key)
+
+        entry_size = len(key) + len(value.encode('utf-8'))
+        if entry_size > self.max_bytes:
+            return
+
+        self.entries[key] = (value, created, entry_size)
+        self.size += entry_size
+
+        while self.size > self.max_bytes:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, _, entry_size = self.entries.pop(key)
+        self.size -= entry_size
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'size_bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'persistent': self.disk is not None
+            }
@@ -0,0 +1,113 @@
+# health.py - Cached readiness probe for the Ollama backend
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+HEALTH_REFRESH_INTERVAL = float(os.getenv("HEALTH_REFRESH_INTERVAL", 15))
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", 3))
+# A result older than this many intervals means the prober itself is stuck
+HEALTH_STALE_INTERVALS = 3
+
+
+class BackendProbe:
+    """
+    Checks every Ollama backend in the pool through its non-generating
+    endpoints (/api/tags for the installed models, /api/ps for the loaded
+    ones) on a background thread, so health requests only read the last
+    result. The service is ready while at least one backend can serve.
+    """
+    def __init__(self, session, base_urls, models, interval=HEALTH_REFRESH_INTERVAL, timeout=HEALTH_PROBE_TIMEOUT, on_refresh=None):
+        self.session = session
+        if isinstance(base_urls, str):
+            base_urls = [base_urls]
+        self.base_urls = [url.rstrip('/') for url in base_urls]
+        self.models = models
+        self.on_refresh = on_refresh
+        self.interval = interval
+        self.timeout = timeout
+        self.result = None
+        self.checked_at = None
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name="ollama-health", daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            result = self.refresh()
+            if self.on_refresh:
+                try:
+                    self.on_refresh(result)
+                except Exception as e:
+                    logger.error(f"Health probe hook failed: {str(e)}")
+            time.sleep(self.interval)
+
+    def refresh(self):
+        backends = [self._probe(url) for url in self.base_urls]
+        connected = [backend for backend in backends if backend['ollama_connected']]
+        ready = [backend for backend in connected if backend['model_available']]
+        # Top-level timing and status describe a backend that can serve, if any
+        primary = (ready or connected or backends)[0]
+        result = {
+            'ollama_connected': bool(connected),
+            'model_available': bool(ready),
+            'model_loaded': any(backend['model_loaded'] for backend in ready),
+            'ollama_status': primary['ollama_status'],
+            'ollama_response_time': primary['ollama_response_time'],
+            'backends_ready': len(ready),
+            'backends': backends
+        }
+
+        with self.lock:
+            self.result = result
+            self.checked_at = time.time()
+        return result
+
+    def _probe(self, base_url):
+        result = {'url': base_url, 'ollama_connected': False, 'model_available': False, 'model_loaded': False}
+        start_time = time.time()
+        try:
+            response = self.session.get(f"{base_url}/api/tags", timeout=self.timeout)
+            result['ollama_response_time'] = round(time.time() - start_time, 3)
+            result['ollama_connected'] = response.status_code == 200
+
+            if result['ollama_connected']:
+                installed = [model.get('name') for model in response.json().get('models', [])]
+                result['model_available'] = all(model in installed for model in self.models)
+
+                response = self.session.get(f"{base_url}/api/ps", timeout=self.timeout)
+                if response.status_code == 200:
+                    loaded = [model.get('name') for model in response.json().get('models', [])]
+                    result['model_loaded'] = all(model in loaded for model in self.models)
+                    result['loaded_models'] = loaded
+
+            result['ollama_status'] = 'connected' if result['ollama_connected'] else f'http {response.status_code}'
+        except Exception as e:
+            result['ollama_response_time'] = None
+            result['ollama_status'] = f'error: {str(e)}'
+        return result
+
+    def snapshot(self):
+        """Last probe result with its age; probes synchronously the first time."""
+        self.start()
+        with self.lock:
+            result, checked_at = self.result, self.checked_at
+        if result is None:
+            result, checked_at = self.refresh(), time.time()
+
+        age = time.time() - checked_at
+        snapshot = dict(result)
+        snapshot['checked_at'] = datetime.utcfromtimestamp(checked_at).isoformat()
+        snapshot['age_seconds'] = round(age, 1)
+        snapshot['stale'] = age > self.interval * HEALTH_STALE_INTERVALS
+        snapshot['ready'] = result['ollama_connected'] and result['model_available'] and not snapshot['stale']
+        return snapshot
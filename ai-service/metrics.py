@@ -0,0 +1,207 @@
+# metrics.py - Minimal Prometheus-compatible metrics registry
+import bisect
+import math
+import threading
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+TOKEN_RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 120)
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        """For counters mirroring a running total kept elsewhere, refreshed by a collector."""
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def render(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return self.header() + [
+            f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}" for key, value in items
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def render(self):
+        with self.lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self.values.items())
+
+        lines = self.header()
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = format_labels(self.labelnames, key, ("le", format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    Holds this process's metrics. Collectors are callables run at scrape
+    time to refresh gauges that mirror state kept elsewhere.
+    """
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        for collector in self.collectors:
+            collector()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    "accord_http_request_duration_seconds", "HTTP request latency by route.", ("method", "route", "status"))
+OLLAMA_LATENCY = REGISTRY.histogram(
+    "accord_ollama_request_duration_seconds", "Total Ollama generation time.", ("model", "mode"))
+OLLAMA_FIRST_TOKEN = REGISTRY.histogram(
+    "accord_ollama_time_to_first_token_seconds", "Time until Ollama produced the first token.", ("model", "mode"))
+OLLAMA_TOKENS_PER_SECOND = REGISTRY.histogram(
+    "accord_ollama_tokens_per_second", "Completion tokens generated per second.", ("model",), TOKEN_RATE_BUCKETS)
+OLLAMA_PROMPT_EVAL = REGISTRY.histogram(
+    "accord_ollama_prompt_eval_seconds", "Time Ollama spent evaluating the prompt.", ("model", "context"))
+OLLAMA_PROMPT_EVAL_TOKENS = REGISTRY.histogram(
+    "accord_ollama_prompt_eval_tokens", "Prompt tokens Ollama had to evaluate per request.", ("model", "context"),
+    (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192))
+OLLAMA_PROMPT_TOKENS = REGISTRY.counter(
+    "accord_ollama_prompt_tokens_total", "Prompt tokens evaluated by Ollama.", ("model",))
+OLLAMA_COMPLETION_TOKENS = REGISTRY.counter(
+    "accord_ollama_completion_tokens_total", "Completion tokens generated by Ollama.", ("model",))
+OLLAMA_ERRORS = REGISTRY.counter(
+    "accord_ollama_errors_total", "Failed Ollama calls by error class.", ("kind",))
+RATE_LIMITED = REGISTRY.counter(
+    "accord_rate_limited_requests_total", "Requests rejected with 429.", ("route",))
+GENERATIONS_IN_FLIGHT = REGISTRY.gauge(
+    "accord_generations_in_flight", "Ollama generations currently running.")
+GENERATIONS_QUEUED = REGISTRY.gauge(
+    "accord_generations_queued", "Generations waiting for a backend slot.")
+CACHE_EVENTS = REGISTRY.counter(
+    "accord_response_cache_events_total", "Response cache lookups by result.", ("result",))
+BACKEND_OUTSTANDING = REGISTRY.gauge(
+    "accord_backend_outstanding_requests", "Requests in progress per Ollama backend.", ("backend",))
+BACKEND_AVAILABLE = REGISTRY.gauge(
+    "accord_backend_available", "Whether an Ollama backend is in rotation (1) or ejected (0).", ("backend",))
+
+GENERATIONS_IN_FLIGHT.set(0)
+GENERATIONS_QUEUED.set(0)
+
+
+def observe_ollama_response(data, model, mode, total_time, first_token_time=None, context_reused=False):
+    """Records latency and token counts from an Ollama response (or final stream chunk)."""
+    OLLAMA_LATENCY.observe(total_time, model=model, mode=mode)
+
+    # Labelled by whether previous context tokens were sent, to compare prompt reuse
+    context = 'reused' if context_reused else 'none'
+    if data.get("prompt_eval_duration"):
+        OLLAMA_PROMPT_EVAL.observe(data["prompt_eval_duration"] / 1e9, model=model, context=context)
+    if data.get("prompt_eval_count") is not None:
+        OLLAMA_PROMPT_EVAL_TOKENS.observe(data["prompt_eval_count"], model=model, context=context)
+
+    if first_token_time is None and data.get("prompt_eval_duration") is not None:
+        # Non-streamed: the model starts emitting once loading and prompt evaluation are done
+        first_token_time = (data.get("load_duration", 0) + data["prompt_eval_duration"]) / 1e9
+    if first_token_time is not None:
+        OLLAMA_FIRST_TOKEN.observe(first_token_time, model=model, mode=mode)
+
+    if data.get("prompt_eval_count"):
+        OLLAMA_PROMPT_TOKENS.inc(data["prompt_eval_count"], model=model)
+    if data.get("eval_count"):
+        OLLAMA_COMPLETION_TOKENS.inc(data["eval_count"], model=model)
+        if data.get("eval_duration"):
+            OLLAMA_TOKENS_PER_SECOND.observe(data["eval_count"] / (data["eval_duration"] / 1e9), model=model)
@@ -0,0 +1,124 @@
+# models.py - Model routing, warm-up and keep_alive pinning
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "llama3:instruct"
+# Smaller/faster model for analysis_mode summaries, larger one for open-ended chat
+ANALYSIS_MODEL = os.getenv("ANALYSIS_MODEL", DEFAULT_MODEL)
+CHAT_MODEL = os.getenv("CHAT_MODEL", DEFAULT_MODEL)
+# How long Ollama keeps a model in memory after a request ("-1" pins it)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+MODEL_WARMUP_TIMEOUT = float(os.getenv("MODEL_WARMUP_TIMEOUT", 120))
+
+
+class ModelManager:
+    """
+    Picks the model for each kind of request and keeps those models loaded:
+    they are preloaded at startup and reloaded whenever the health probe
+    reports one of them as no longer resident.
+    """
+    def __init__(self, session, base_urls, routes=None, keep_alive=OLLAMA_KEEP_ALIVE, options=None):
+        self.session = session
+        # Every backend in the pool needs the models loaded
+        self.base_urls = [base_urls] if isinstance(base_urls, str) else list(base_urls)
+        self.routes = routes or {'analysis': ANALYSIS_MODEL, 'chat': CHAT_MODEL}
+        self.keep_alive = keep_alive
+        # Model options that decide how Ollama loads it (e.g. num_ctx)
+        self.options = options or {}
+        self.warmed = {}
+        self.lock = threading.Lock()
+        self.warming = set()  # (model, backend URL) loads in progress
+        self.started = False
+
+    @property
+    def models(self):
+        return sorted(set(self.routes.values()))
+
+    def model_for(self, mode):
+        return self.routes.get(mode, self.routes['chat'])
+
+    def warm_up(self, model, base_urls=None):
+        """
+        Loads model on the given backends (all by default) without generating;
+        Ollama treats an empty prompt as a load request.
+        """
+        urls = self._reserve(model, base_urls)
+        if not urls:
+            return False
+        return self._warm(model, urls)
+
+    def warm_up_in_background(self, model, base_urls=None):
+        """Like warm_up, but returns at once; loads already in progress are skipped."""
+        urls = self._reserve(model, base_urls)
+        if urls:
+            threading.Thread(target=self._warm, args=(model, urls), name="model-reload", daemon=True).start()
+
+    def _reserve(self, model, base_urls):
+        with self.lock:
+            urls = [url for url in base_urls or self.base_urls if (model, url) not in self.warming]
+            self.warming.update((model, url) for url in urls)
+        return urls
+
+    def _warm(self, model, urls):
+        try:
+            loaded = [self._load(model, url) for url in urls]
+            if any(loaded):
+                self.warmed[model] = time.time()
+            return all(loaded)
+        finally:
+            with self.lock:
+                self.warming.difference_update((model, url) for url in urls)
+
+    def _load(self, model, url):
+        try:
+            start_time = time.time()
+            response = self.session.post(
+                f"{url}/api/generate",
+                json={"model": model, "prompt": "", "keep_alive": self.keep_alive, "stream": False, "options": self.options},
+                timeout=MODEL_WARMUP_TIMEOUT
+            )
+            if response.status_code != 200:
+                logger.error(f"Warm-up of {model} on {url} failed: HTTP {response.status_code}")
+                return False
+
+            elapsed = time.time() - start_time
+            logger.info(f"Model {model} loaded on {url} in {elapsed:.2f}s (keep_alive={self.keep_alive})")
+            return True
+        except Exception as e:
+            logger.error(f"Warm-up of {model} on {url} failed: {str(e)}")
+            return False
+
+    def warm_up_all(self):
+        for model in self.models:
+            self.warm_up(model)
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        threading.Thread(target=self.warm_up_all, name="model-warmup", daemon=True).start()
+
+    def ensure_resident(self, probe_result):
+        """
+        Health probe hook: reload configured models a backend has unloaded.
+        Loads run in the background so the probe keeps refreshing meanwhile.
+        """
+        for backend in probe_result.get('backends', []):
+            if not backend.get('ollama_connected') or 'loaded_models' not in backend:
+                continue
+            for model in self.models:
+                if model not in backend['loaded_models']:
+                    logger.info(f"Model {model} is no longer resident on {backend['url']}, reloading")
+                    self.warm_up_in_background(model, [backend['url']])
+
+    def stats(self):
+        return {
+            'routes': dict(self.routes),
+            'keep_alive': self.keep_alive,
+            'seconds_since_load': {model: round(time.time() - loaded, 1) for model, loaded in self.warmed.items()}
+        }
@@ -0,0 +1,127 @@
+# prompt_budget.py - Token-aware selection of chat history for prompts
+import logging
+import math
+import os
+import re
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+MODEL_CONTEXT_TOKENS = int(os.getenv("MODEL_CONTEXT_TOKENS", 8192))
+MAX_PROMPT_TOKENS = int(os.getenv("MAX_PROMPT_TOKENS", 1500))
+PROMPT_SAFETY_TOKENS = int(os.getenv("PROMPT_SAFETY_TOKENS", 64))
+# tiktoken downloads an encoding's BPE file on first use and caches it in
+# TIKTOKEN_CACHE_DIR (default: a tiktoken directory under the system temp
+# dir). Offline hosts need that file placed there in advance, e.g. by
+# running the service once with network access and copying the cache;
+# without it token counts fall back to the estimate below.
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+
+WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+class TokenCounter:
+    """
+    Counts tokens with tiktoken when it is installed (its BPE vocabularies
+    track llama3's closely); otherwise falls back to a conservative estimate.
+    """
+    def __init__(self, encoding=TOKENIZER_ENCODING):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.get_encoding(encoding)
+            except Exception as e:
+                logger.warning(f"Tokenizer '{encoding}' unavailable, estimating token counts: {e}")
+
+    @property
+    def exact(self):
+        return self.encoding is not None
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return max(len(WORD_PATTERN.findall(text)), math.ceil(len(text) / 4))
+
+    def tail(self, text, max_tokens):
+        """Last max_tokens worth of text."""
+        if max_tokens <= 0:
+            return ""
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            return self.encoding.decode(tokens[-max_tokens:])
+        return text[-max_tokens * 4:]
+
+
+class PromptBudget:
+    """
+    Splits the model context between generation, the fixed instructions and
+    the user's question, and fills whatever is left with the most recent
+    whole chat messages.
+    """
+    def __init__(self, num_predict, counter=None, context_tokens=MODEL_CONTEXT_TOKENS,
+                 max_prompt_tokens=MAX_PROMPT_TOKENS, safety_tokens=PROMPT_SAFETY_TOKENS):
+        self.counter = counter or TokenCounter()
+        self.num_predict = num_predict
+        self.context_tokens = context_tokens
+        self.max_prompt_tokens = max_prompt_tokens
+        self.safety_tokens = safety_tokens
+
+    @property
+    def prompt_tokens(self):
+        return min(self.max_prompt_tokens, self.context_tokens - self.num_predict) - self.safety_tokens
+
+    @property
+    def input_tokens(self):
+        """Most tokens a request can carry (prompt plus reused context) within num_ctx."""
+        return self.context_tokens - self.num_predict - self.safety_tokens
+
+    def history_budget(self, fixed_prompt):
+        """Tokens left for history once instructions and question are in."""
+        return max(0, self.prompt_tokens - self.counter.count(fixed_prompt))
+
+    def fit_messages(self, messages, budget, pinned=None):
+        """
+        Newest-first selection of whole messages that fit in budget. pinned
+        (e.g. a conversation summary) goes first if it takes at most half.
+        """
+        used = 0
+        head = []
+        if pinned:
+            pinned_tokens = self.counter.count(pinned) + 1
+            if pinned_tokens <= budget // 2:
+                head.append(pinned)
+                used += pinned_tokens
+
+        selected = []
+        for message in reversed(messages):
+            tokens = self.counter.count(message) + 1
+            if used + tokens > budget:
+                if not selected:
+                    # The newest message alone is too long; keep its end.
+                    selected.append("..." + self.counter.tail(message, budget - used - 1))
+                break
+            selected.append(message)
+            used += tokens
+
+        dropped = len(messages) - len(selected)
+        if dropped > 0:
+            logger.info(f"Prompt budget kept {len(selected)} of {len(messages)} messages ({used}/{budget} tokens)")
+            if selected and not selected[-1].startswith("..."):
+                selected.append("...")
+
+        selected.reverse()
+        return "\n\n".join(head + ["\n".join(selected)]) if head else "\n".join(selected)
+
+    def stats(self):
+        return {
+            'context_tokens': self.context_tokens,
+            'max_prompt_tokens': self.prompt_tokens,
+            'generation_tokens': self.num_predict,
+            'exact_tokenizer': self.counter.exact
+        }
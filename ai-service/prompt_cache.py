@@ -0,0 +1,183 @@
+# prompt_cache.py - Prefix-stable chat history and Ollama context reuse
+import logging
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from summary import message_hash
+
+logger = logging.getLogger(__name__)
+
+# "stable" keeps each conversation's history window anchored so prompts only
+# grow at the end; "recent" re-selects the newest messages on every call
+PROMPT_LAYOUT = os.getenv("PROMPT_LAYOUT", "stable")
+# Share of the history budget filled when a window is (re)anchored; the rest
+# is room for new messages before the anchor has to move again
+PREFIX_FILL_RATIO = float(os.getenv("PREFIX_FILL_RATIO", 0.6))
+# Send the previous response's context tokens back so Ollama only evaluates new text
+OLLAMA_CONTEXT_REUSE = os.getenv("OLLAMA_CONTEXT_REUSE", "true").lower() in ("1", "true", "yes")
+# Optional cap on reused context below what the model window allows (0 = none)
+MAX_REUSED_CONTEXT_TOKENS = int(os.getenv("MAX_REUSED_CONTEXT_TOKENS", 0))
+PREFIX_MAX_CONVERSATIONS = int(os.getenv("PREFIX_MAX_CONVERSATIONS", 1000))
+
+
+# What a prompt needs to continue a conversation: its key, the previous
+# response's context tokens when it can be extended, and the newest message
+# and pinned text the prompt covers (stored with its own context afterwards)
+PromptPrefix = namedtuple('PromptPrefix', 'conversation context last_message pinned')
+
+
+class PrefixState:
+    def __init__(self):
+        self.anchor = None  # hash of the first message in the window
+        self.pinned = None
+        self.context = None
+        self.model = None
+        self.last_message = None  # hash of the newest message covered by context
+
+
+class PrefixCache:
+    """
+    Per-conversation prompt state. The history window starts at a fixed
+    message and only grows, so consecutive prompts share everything up to
+    the newest messages and the backend can reuse its evaluated prefix.
+    When the window outgrows its budget it is re-anchored to leave room to
+    grow again. After a response, its context tokens are kept so the next
+    prompt can carry just the messages that arrived since; the reused
+    context plus those messages must still fit the model's context window.
+    """
+    def __init__(self, budget, fill_ratio=PREFIX_FILL_RATIO, context_reuse=OLLAMA_CONTEXT_REUSE,
+                 max_context_tokens=MAX_REUSED_CONTEXT_TOKENS, max_conversations=PREFIX_MAX_CONVERSATIONS):
+        self.budget = budget
+        self.fill_ratio = fill_ratio
+        self.context_reuse = context_reuse
+        self.max_context_tokens = max_context_tokens
+        self.max_conversations = max_conversations
+        self.conversations = OrderedDict()
+        self.lock = threading.Lock()
+        self.reanchors = 0
+        self.context_hits = 0
+        self.context_misses = 0
+
+    def _state(self, conversation_id):
+        state = self.conversations.get(conversation_id)
+        if state is None:
+            state = PrefixState()
+            self.conversations[conversation_id] = state
+            while len(self.conversations) > self.max_conversations:
+                self.conversations.popitem(last=False)
+        self.conversations.move_to_end(conversation_id)
+        return state
+
+    def window(self, conversation_id, messages, budget, pinned=""):
+        """History text for a full prompt, anchored to the conversation's window."""
+        counter = self.budget.counter
+        pinned_tokens = counter.count(pinned) + 1 if pinned else 0
+        tokens = [counter.count(message) + 1 for message in messages]
+
+        with self.lock:
+            state = self._state(conversation_id)
+            start = None
+            if state.anchor is not None and state.pinned == pinned:
+                start = next((i for i, message in enumerate(messages) if message_hash(message) == state.anchor), None)
+            if start is None or pinned_tokens + sum(tokens[start:]) > budget:
+                start = self._anchor(tokens, int(budget * self.fill_ratio) - pinned_tokens)
+                if start is None:
+                    # Even the newest message overflows; fall back to plain truncation
+                    state.anchor = None
+                    return self.budget.fit_messages(messages, budget, pinned=pinned)
+                if state.anchor is not None:
+                    self.reanchors += 1
+                    logger.debug(f"Re-anchored prompt window for conversation {conversation_id}")
+            state.anchor = message_hash(messages[start]) if messages else None
+            state.pinned = pinned
+
+        selected = (["..."] if start > 0 else []) + messages[start:]
+        history = "\n".join(selected)
+        return f"{pinned}\n\n{history}" if pinned else history
+
+    def _anchor(self, tokens, budget):
+        used = 0
+        start = len(tokens)
+        for index in range(len(tokens) - 1, -1, -1):
+            if used + tokens[index] > budget:
+                break
+            used += tokens[index]
+            start = index
+        if start == len(tokens) and tokens:
+            return None
+        return start
+
+    def prefix(self, conversation_id, messages, pinned="", context=None):
+        """The PromptPrefix for a prompt covering messages."""
+        last_message = message_hash(messages[-1]) if messages else None
+        return PromptPrefix(conversation_id, context, last_message, pinned)
+
+    def continuation(self, conversation_id, model, messages, pinned="", reserve_tokens=0):
+        """
+        (context, new_messages) when the previous response's context can be
+        extended with just the messages since, otherwise None. reserve_tokens
+        is the rest of the continuation prompt (instructions and question).
+        """
+        if not self.context_reuse:
+            return None
+
+        with self.lock:
+            state = self.conversations.get(conversation_id)
+            usable = (
+                state is not None and state.context and state.model == model
+                and state.pinned == pinned and state.last_message is not None
+            )
+            index = None
+            if usable:
+                index = next(
+                    (i for i in range(len(messages) - 1, -1, -1) if message_hash(messages[i]) == state.last_message), None
+                )
+            if index is None:
+                self.context_misses += 1
+                return None
+
+            new_messages = messages[index + 1:]
+            if not new_messages:
+                # Nothing to continue with: the full prompt is stable, so a
+                # repeated request can be answered from the response cache
+                return None
+
+            new_tokens = sum(self.budget.counter.count(message) + 1 for message in new_messages)
+            # The context already holds the previous prompt and response, so it is
+            # bounded by the model window (num_ctx), not by the history budget
+            limit = self.budget.input_tokens
+            if self.max_context_tokens:
+                limit = min(limit, self.max_context_tokens)
+            if len(state.context) + new_tokens + reserve_tokens > limit:
+                # Start over with a full prompt rather than let context grow without bound
+                state.context = None
+                self.context_misses += 1
+                return None
+
+            self.context_hits += 1
+            self.conversations.move_to_end(conversation_id)
+            return state.context, new_messages
+
+    def remember(self, prefix, model, context):
+        """Stores the context returned for the prompt built with prefix."""
+        if not self.context_reuse or not context:
+            return
+        with self.lock:
+            state = self.conversations.get(prefix.conversation)
+            if state is None:
+                return
+            state.last_message, state.pinned = prefix.last_message, prefix.pinned
+            state.context = context
+            state.model = model
+
+    def stats(self):
+        with self.lock:
+            return {
+                'layout': PROMPT_LAYOUT,
+                'conversations': len(self.conversations),
+                'reanchors': self.reanchors,
+                'context_reuse': self.context_reuse,
+                'context_hits': self.context_hits,
+                'context_misses': self.context_misses
+            }
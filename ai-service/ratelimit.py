@@ -0,0 +1,271 @@
+# ratelimit.py - Rate limiting policies, algorithms and shared backends
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+Decision = namedtuple('Decision', ['allowed', 'limit', 'window', 'remaining', 'retry_after', 'reset_after'])
+
+
+class RateLimitPolicy:
+    def __init__(self, limit, window, algorithm='token_bucket'):
+        self.limit = limit
+        self.window = window
+        self.algorithm = ALGORITHMS[algorithm]
+        self.algorithm_name = algorithm
+
+    @property
+    def ttl(self):
+        return self.window * 2
+
+
+class TokenBucket:
+    """
+    State is (tokens, updated). Refills continuously at limit/window per
+    second up to limit, so there is no burst at window edges.
+    """
+    @staticmethod
+    def apply(state, policy, now, cost=1):
+        rate = policy.limit / policy.window
+        if state is None:
+            tokens, updated = float(policy.limit), now
+        else:
+            tokens, updated = state
+        tokens = min(policy.limit, tokens + (now - updated) * rate)
+
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+
+        retry_after = 0 if allowed else (cost - tokens) / rate
+        reset_after = (policy.limit - tokens) / rate
+        decision = Decision(allowed, policy.limit, policy.window, int(tokens), retry_after, reset_after)
+        return (tokens, now), decision
+
+
+class SlidingWindow:
+    """
+    Sliding-window counter: state is (window_start, current, previous). The
+    previous window's count is weighted by how much of it still overlaps.
+    """
+    @staticmethod
+    def apply(state, policy, now, cost=1):
+        window = policy.window
+        window_start = math.floor(now / window) * window
+        if state is None:
+            current, previous = 0.0, 0.0
+        else:
+            start, current, previous = state
+            if start != window_start:
+                previous = current if window_start - start == window else 0.0
+                current = 0.0
+
+        overlap = 1 - (now - window_start) / window
+        used = previous * overlap + current
+
+        allowed = used + cost <= policy.limit
+        if allowed:
+            current += cost
+            used += cost
+
+        reset_after = window_start + window - now
+        if allowed:
+            retry_after = 0
+        elif previous and current + cost <= policy.limit:
+            # Wait until enough of the previous window has slid out
+            retry_after = max(0.0, (used + cost - policy.limit) / previous * window)
+        else:
+            retry_after = reset_after
+        decision = Decision(allowed, policy.limit, policy.window, max(0, int(policy.limit - used)), retry_after, reset_after)
+        return (window_start, current, previous), decision
+
+
+ALGORITHMS = {
+    'token_bucket': TokenBucket,
+    'sliding_window': SlidingWindow,
+}
+
+
+class MemoryBackend:
+    """
+    Per-process store. Each entry keeps the expiry of the policy that wrote
+    it, since keys under different policies live for different times.
+    Expiry is amortized: each call checks a few entries, oldest first, and
+    rotates the live ones to the back.
+    """
+    name = 'memory'
+    SWEEP_PER_CALL = 8
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def apply(self, key, policy, now, cost=1):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            state = entry[0] if entry and now <= entry[1] else None
+            if cost:
+                state, decision = policy.algorithm.apply(state, policy, now, cost)
+                self.entries[key] = (state, now + policy.ttl)
+            else:
+                _, decision = policy.algorithm.apply(state, policy, now, 0)
+                if entry:
+                    self.entries[key] = entry
+            self._sweep(now)
+        return decision
+
+    def _sweep(self, now):
+        for _ in range(min(self.SWEEP_PER_CALL, len(self.entries))):
+            key, entry = self.entries.popitem(last=False)
+            if now <= entry[1]:
+                self.entries[key] = entry
+
+    def size(self):
+        return len(self.entries)
+
+
+class SQLiteBackend:
+    """File-backed store shared by every worker process on the host."""
+    name = 'sqlite'
+    SWEEP_EVERY = 500
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.calls = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limits "
+                "(key TEXT PRIMARY KEY, state TEXT NOT NULL, updated REAL NOT NULL, expires REAL NOT NULL DEFAULT 0)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(rate_limits)")]
+            if 'expires' not in columns:
+                # Tables created before per-entry expiry; their rows read as expired
+                conn.execute("ALTER TABLE rate_limits ADD COLUMN expires REAL NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS rate_limits_expires ON rate_limits (expires)")
+
+    def _connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self.local.conn = conn
+        return conn
+
+    def apply(self, key, policy, now, cost=1):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT state, expires FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            state = None
+            if row and now <= row[1]:
+                state = tuple(float(value) for value in row[0].split(','))
+
+            new_state, decision = policy.algorithm.apply(state, policy, now, cost)
+            if cost:
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_limits (key, state, updated, expires) VALUES (?, ?, ?, ?)",
+                    (key, ','.join(repr(value) for value in new_state), now, now + policy.ttl)
+                )
+
+            self.calls += 1
+            if self.calls % self.SWEEP_EVERY == 0:
+                conn.execute("DELETE FROM rate_limits WHERE expires < ?", (now,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return decision
+
+    def size(self):
+        return self._connect().execute("SELECT COUNT(*) FROM rate_limits").fetchone()[0]
+
+
+class RedisBackend:
+    """
+    Store on a Redis-protocol server. State is updated with WATCH/MULTI so
+    the same algorithm code runs here as in the local backends.
+    """
+    name = 'redis'
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError("The 'redis' package is required for a redis:// rate limit backend")
+        self.client = redis.Redis.from_url(url)
+        self.client.ping()
+
+    def apply(self, key, policy, now, cost=1):
+        redis_key = f"ratelimit:{key}"
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(redis_key)
+                    raw = pipe.get(redis_key)
+                    state = tuple(float(value) for value in raw.decode().split(',')) if raw else None
+
+                    new_state, decision = policy.algorithm.apply(state, policy, now, cost)
+                    if not cost:
+                        pipe.unwatch()
+                        return decision
+
+                    pipe.multi()
+                    pipe.set(redis_key, ','.join(repr(value) for value in new_state), px=int(policy.ttl * 1000))
+                    pipe.execute()
+                    return decision
+                except redis.WatchError:
+                    continue
+
+    def size(self):
+        return None
+
+
+def create_backend(url):
+    """memory (default), sqlite:///path/to/file.db or redis://host:port/db"""
+    if not url or url == 'memory':
+        return MemoryBackend()
+    if url.startswith('sqlite:///'):
+        return SQLiteBackend(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported rate limit backend: {url}")
+
+
+class RateLimiter:
+    """
+    Applies a policy per (route, client key). key_policies override the
+    route policy for specific clients, e.g. a trusted internal caller.
+    """
+    def __init__(self, policies, default_policy, backend=None, key_policies=None):
+        self.policies = policies
+        self.default_policy = default_policy
+        self.key_policies = key_policies or {}
+        self.backend = backend or MemoryBackend()
+        self.rejected = 0
+
+    def policy_for(self, route, key=None):
+        if key in self.key_policies:
+            return self.key_policies[key]
+        return self.policies.get(route, self.default_policy)
+
+    def hit(self, route, key):
+        policy = self.policy_for(route, key)
+        decision = self.backend.apply(f"{route}:{key}", policy, time.time())
+        if not decision.allowed:
+            self.rejected += 1
+        return decision
+
+    def peek(self, route, key):
+        return self.backend.apply(f"{route}:{key}", self.policy_for(route, key), time.time(), cost=0)
+
+    def stats(self):
+        return {
+            'backend': self.backend.name,
+            'tracked_keys': self.backend.size(),
+            'rejected': self.rejected
+        }
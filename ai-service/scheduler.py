@@ -0,0 +1,255 @@
+# scheduler.py - Priority and per-tenant fair scheduling of generations
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+
+import metrics
+
+MAX_CONCURRENT_GENERATIONS = int(os.getenv("MAX_CONCURRENT_GENERATIONS", 4))
+MAX_QUEUED_GENERATIONS = int(os.getenv("MAX_QUEUED_GENERATIONS", 200))
+QUEUE_RETRY_AFTER = int(os.getenv("QUEUE_RETRY_AFTER", 5))
+
+# Lower value is served first; within a class tenants share by weight
+PRIORITIES = {'interactive': 0, 'bulk': 1}
+# How long a request may wait for a slot before its caller has given up
+# (the chat server aborts @ai requests after 30 s)
+DEFAULT_DEADLINES = {
+    'interactive': float(os.getenv("INTERACTIVE_DEADLINE", 30)),
+    'bulk': float(os.getenv("BULK_DEADLINE", 60)),
+}
+# "tenant=weight" pairs; a tenant with weight 2 gets twice the share of one with 1
+TENANT_WEIGHTS = os.getenv("TENANT_WEIGHTS", "")
+
+QUEUE_WAIT = metrics.REGISTRY.histogram(
+    "accord_scheduler_wait_seconds", "Time spent waiting for a generation slot.", ("priority",))
+DROPPED = metrics.REGISTRY.counter(
+    "accord_scheduler_dropped_total", "Queued requests dropped before reaching the backend.", ("priority", "reason"))
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Ticket:
+    def __init__(self, priority, tenant, timeout=None, weight=1.0):
+        self.priority = priority if priority in PRIORITIES else 'bulk'
+        self.tenant = tenant or 'anonymous'
+        self.weight = weight
+        self.enqueued = time.time()
+        self.deadline = self.enqueued + (timeout if timeout is not None else DEFAULT_DEADLINES[self.priority])
+        self.granted = False
+        self.cancelled = False
+        self.finish_tag = 0.0
+        self.waker = None
+
+    def expired(self, now):
+        return now > self.deadline
+
+
+class FairQueue:
+    """
+    Strict priority between classes; weighted fair queuing (start-time
+    fair queuing over virtual time) between tenants inside a class, so one
+    busy chat cannot crowd out everyone else's requests. Not thread-safe.
+    """
+    def __init__(self):
+        self.heaps = {priority: [] for priority in PRIORITIES}
+        self.virtual_time = {priority: 0.0 for priority in PRIORITIES}
+        self.last_finish = {}
+        self.counter = itertools.count()
+        self.size = 0
+
+    def push(self, ticket):
+        key = (ticket.priority, ticket.tenant)
+        start = max(self.virtual_time[ticket.priority], self.last_finish.get(key, 0.0))
+        ticket.finish_tag = start + 1.0 / ticket.weight
+        self.last_finish[key] = ticket.finish_tag
+        heapq.heappush(self.heaps[ticket.priority], (ticket.finish_tag, next(self.counter), ticket))
+        self.size += 1
+
+    def pop(self, now):
+        """Next live ticket, or None. Returns (ticket, dropped) so expired ones can be reported."""
+        dropped = []
+        for priority in sorted(PRIORITIES, key=PRIORITIES.get):
+            heap = self.heaps[priority]
+            while heap:
+                finish_tag, _, ticket = heapq.heappop(heap)
+                if ticket.cancelled:
+                    continue
+                self.size -= 1
+                if ticket.expired(now):
+                    dropped.append(ticket)
+                    continue
+                self.virtual_time[priority] = finish_tag
+                return ticket, dropped
+            if not heap:
+                self._forget_idle(priority)
+        return None, dropped
+
+    def cancel(self, ticket):
+        """Marks a queued ticket dead; it is discarded lazily when reached."""
+        ticket.cancelled = True
+        self.size -= 1
+
+    def _forget_idle(self, priority):
+        # Nothing queued in this class: tenants restart from the current virtual time
+        for key in [key for key in self.last_finish if key[0] == priority]:
+            del self.last_finish[key]
+
+    def depth(self):
+        return {priority: sum(1 for _, _, t in heap if not t.cancelled) for priority, heap in self.heaps.items()}
+
+
+def parse_weights(spec):
+    weights = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        tenant, _, weight = item.rpartition('=')
+        weights[tenant] = float(weight)
+    return weights
+
+
+class _BaseScheduler:
+    def __init__(self, slots=MAX_CONCURRENT_GENERATIONS, max_queued=MAX_QUEUED_GENERATIONS, weights=None):
+        self.slots = slots
+        self.weights = parse_weights(TENANT_WEIGHTS) if weights is None else weights
+        self.max_queued = max_queued
+        self.active = 0
+        self.queue = FairQueue()
+        self.rejected = 0
+        self.expired = 0
+
+    def _ticket(self, priority, tenant, timeout):
+        return Ticket(priority, tenant, timeout, self.weights.get(tenant, 1.0))
+
+    def _admit(self, ticket):
+        if self.active < self.slots and self.queue.size == 0:
+            self.active += 1
+            ticket.granted = True
+            return True
+        if self.queue.size >= self.max_queued:
+            self.rejected += 1
+            DROPPED.inc(priority=ticket.priority, reason='queue_full')
+            raise QueueFullError()
+        self.queue.push(ticket)
+        return False
+
+    def _drop(self, ticket, reason='deadline', queued=True):
+        if ticket.cancelled:
+            return
+        if queued:
+            self.queue.cancel(ticket)
+        ticket.cancelled = True
+        self.expired += 1
+        DROPPED.inc(priority=ticket.priority, reason=reason)
+
+    def _next(self):
+        """Picks the ticket to hand a freed slot to (caller holds the lock)."""
+        ticket, dropped = self.queue.pop(time.time())
+        for stale in dropped:
+            self._drop(stale, queued=False)
+            self._wake(stale)
+        if ticket is None:
+            self.active -= 1
+            return None
+        ticket.granted = True
+        return ticket
+
+    def _observe(self, ticket):
+        QUEUE_WAIT.observe(time.time() - ticket.enqueued, priority=ticket.priority)
+
+    def stats(self):
+        return {
+            'active_generations': self.active,
+            'max_concurrent_generations': self.slots,
+            'queued_generations': self.queue.size,
+            'queued_by_priority': self.queue.depth(),
+            'max_queued_generations': self.max_queued,
+            'rejected_generations': self.rejected,
+            'expired_generations': self.expired,
+            'default_deadlines': dict(DEFAULT_DEADLINES),
+            'tenant_weights': dict(self.weights)
+        }
+
+
+class GenerationScheduler(_BaseScheduler):
+    """Thread-based scheduler: acquire() blocks the calling worker thread."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+
+    def acquire(self, priority='interactive', tenant=None, timeout=None):
+        """
+        Waits for a generation slot. Raises QueueFullError when the queue is
+        full, DeadlineExceeded when the slot did not come within timeout.
+        """
+        ticket = self._ticket(priority, tenant, timeout)
+        with self.lock:
+            if self._admit(ticket):
+                self._observe(ticket)
+                return ticket
+            ticket.waker = threading.Event()
+
+        ticket.waker.wait(max(0.0, ticket.deadline - time.time()))
+        with self.lock:
+            if not ticket.granted:
+                self._drop(ticket)
+                raise DeadlineExceeded()
+        self._observe(ticket)
+        return ticket
+
+    def release(self):
+        with self.lock:
+            ticket = self._next()
+        if ticket is not None:
+            ticket.waker.set()
+
+    def _wake(self, ticket):
+        ticket.waker.set()
+
+
+class AsyncGenerationScheduler(_BaseScheduler):
+    """asyncio scheduler: acquire() awaits instead of holding a thread."""
+    async def acquire(self, priority='interactive', tenant=None, timeout=None):
+        ticket = self._ticket(priority, tenant, timeout)
+        if self._admit(ticket):
+            self._observe(ticket)
+            return ticket
+
+        ticket.waker = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.waker), max(0.0, ticket.deadline - time.time()))
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # Client went away while queued
+            self._abandon(ticket, 'cancelled')
+            raise
+
+        if not ticket.granted:
+            self._abandon(ticket, 'deadline')
+            raise DeadlineExceeded()
+        self._observe(ticket)
+        return ticket
+
+    def _abandon(self, ticket, reason):
+        if ticket.granted:
+            # Slot was handed over just as the caller left; pass it on
+            self.release()
+        else:
+            self._drop(ticket, reason)
+
+    def release(self):
+        ticket = self._next()
+        if ticket is not None and not ticket.waker.done():
+            ticket.waker.set_result(True)
+
+    def _wake(self, ticket):
+        if not ticket.waker.done():
+            ticket.waker.set_result(False)
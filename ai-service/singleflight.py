@@ -0,0 +1,97 @@
+# singleflight.py - Coalesces identical in-flight generations
+import asyncio
+import threading
+
+
+class SingleFlightTimeout(Exception):
+    pass
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Callers arriving while a call
+    for their key is running wait for it and receive the same result or
+    exception instead of starting their own.
+    """
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, timeout=None):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.calls[key] = call
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if not call.event.wait(timeout):
+                raise SingleFlightTimeout(key)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'in_flight': len(self.calls),
+                'executed': self.executed,
+                'coalesced': self.coalesced
+            }
+
+
+class AsyncSingleFlight:
+    """
+    asyncio flavour of SingleFlight. The shared call runs as its own task so
+    it keeps going for the waiters even if the caller that started it leaves.
+    """
+    def __init__(self):
+        self.tasks = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key, coro_fn, timeout=None):
+        task = self.tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_fn())
+            self.tasks[key] = task
+            task.add_done_callback(lambda _: self.tasks.pop(key, None))
+            self.executed += 1
+        else:
+            self.coalesced += 1
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            raise SingleFlightTimeout(key)
+
+    def stats(self):
+        return {
+            'in_flight': len(self.tasks),
+            'executed': self.executed,
+            'coalesced': self.coalesced
+        }
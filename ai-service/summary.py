@@ -0,0 +1,113 @@
+# summary.py - Rolling conversation summaries
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_RECENT_MESSAGES = int(os.getenv("SUMMARY_RECENT_MESSAGES", 20))
+SUMMARY_FOLD_BATCH = int(os.getenv("SUMMARY_FOLD_BATCH", 10))
+SUMMARY_MAX_CONVERSATIONS = int(os.getenv("SUMMARY_MAX_CONVERSATIONS", 1000))
+SUMMARY_MAX_LENGTH = int(os.getenv("SUMMARY_MAX_LENGTH", 1500))
+
+
+def message_hash(message):
+    return hashlib.sha1(message.encode('utf-8')).hexdigest()
+
+
+def split_messages(chat_data):
+    return [line for line in chat_data.splitlines() if line.strip()]
+
+
+class ConversationSummary:
+    def __init__(self):
+        self.text = ""
+        self.last_folded = None  # hash of the newest message folded into text
+        self.folded_count = 0
+        self.folding = False
+
+
+class ConversationSummaries:
+    """
+    Keeps a compact summary of the older part of each conversation. Prompts
+    are built from that summary plus the recent tail of messages; messages
+    that fall out of the tail are folded into the summary in the background
+    once SUMMARY_FOLD_BATCH of them have accumulated.
+    """
+    def __init__(self, summarize, recent_messages=SUMMARY_RECENT_MESSAGES,
+                 fold_batch=SUMMARY_FOLD_BATCH, max_conversations=SUMMARY_MAX_CONVERSATIONS):
+        self.summarize = summarize
+        self.recent_messages = recent_messages
+        self.fold_batch = fold_batch
+        self.max_conversations = max_conversations
+        self.conversations = OrderedDict()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary")
+
+    def condense(self, conversation_id, messages):
+        """Returns (summary, messages) to prompt with for this conversation."""
+        if len(messages) <= self.recent_messages:
+            return "", messages
+
+        with self.lock:
+            summary = self.conversations.get(conversation_id)
+            if summary is None:
+                summary = ConversationSummary()
+                self.conversations[conversation_id] = summary
+                while len(self.conversations) > self.max_conversations:
+                    self.conversations.popitem(last=False)
+            self.conversations.move_to_end(conversation_id)
+
+            older = messages[:-self.recent_messages]
+            start = self._unfolded_start(summary, older)
+            if start == 0 and summary.last_folded is not None:
+                # History no longer lines up with the summary (edited or
+                # window moved past it); rebuild from scratch.
+                summary.text = ""
+                summary.last_folded = None
+                summary.folded_count = 0
+
+            unfolded = older[start:]
+            summary_text = summary.text
+
+            if len(unfolded) >= self.fold_batch and not summary.folding:
+                summary.folding = True
+                self.executor.submit(self._fold, conversation_id, summary, summary_text, unfolded)
+
+        if summary_text:
+            summary_text = f"[Summary of earlier messages]\n{summary_text}"
+        return summary_text, unfolded + messages[-self.recent_messages:]
+
+    def _unfolded_start(self, summary, older):
+        if summary.last_folded is None:
+            return 0
+        for index in range(len(older) - 1, -1, -1):
+            if message_hash(older[index]) == summary.last_folded:
+                return index + 1
+        return 0
+
+    def _fold(self, conversation_id, summary, previous_text, new_messages):
+        try:
+            text = self.summarize(previous_text, "\n".join(new_messages))
+            if not text:
+                return
+            with self.lock:
+                summary.text = text[:SUMMARY_MAX_LENGTH]
+                summary.last_folded = message_hash(new_messages[-1])
+                summary.folded_count += len(new_messages)
+            logger.info(f"Folded {len(new_messages)} messages into summary for conversation {conversation_id}")
+        except Exception as e:
+            logger.error(f"Failed to update summary for conversation {conversation_id}: {str(e)}")
+        finally:
+            summary.folding = False
+
+    def stats(self):
+        with self.lock:
+            return {
+                'conversations': len(self.conversations),
+                'recent_messages': self.recent_messages,
+                'fold_batch': self.fold_batch
+            }
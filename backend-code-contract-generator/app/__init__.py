@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules shared with ai-service (e.g. backend_pool) live in ../shared
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'shared'))
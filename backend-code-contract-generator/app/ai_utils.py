@@ -1,13 +1,15 @@
-from langchain_community.llms import Ollama
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import Runnable
+import os
+from backend_pool import BackendPool
+from app.models import LazyModel, register
 
 MODEL = "llama3:instruct"
 OLLAMA_URL = "http://localhost:11434"
+# Comma-separated Ollama servers to spread contract generation over
+OLLAMA_URLS = os.getenv("OLLAMA_URLS", OLLAMA_URL)
 
-llm = Ollama(model=MODEL, base_url=OLLAMA_URL)
+pool = BackendPool(OLLAMA_URLS)
 
-prompt = ChatPromptTemplate.from_template("""
+PROMPT = """
 You are a legal assistant trained in Indian contract law.
 Create a fair, clear, and legally sound contract based on this conversation:
 
@@ -24,12 +26,34 @@ Ensure the contract:
 - Uses plain text with clear line breaks between sections
 
 Respond only with the contract. No explanation needed.
-""")
-
-chain: Runnable = prompt | llm
-
-def generate_contract(conversation: str) -> str:
-    return chain.invoke({"conversation": conversation})
+"""
+
+
+def build_chains():
+    # LangChain is slow to import, so it is only imported when first needed
+    from langchain_community.llms import Ollama
+    from langchain_core.prompts import ChatPromptTemplate
+
+    prompt = ChatPromptTemplate.from_template(PROMPT)
+    return {backend.url: prompt | Ollama(model=MODEL, base_url=backend.url) for backend in pool.backends}
+
+
+# One chain per Ollama backend; building them needs no network calls
+chains = register(LazyModel("contract_llm", build_chains, f"LangChain Ollama '{MODEL}' chains"))
+
+def stream_contract(conversation: str, affinity: str = None):
+    """Yields the contract text in pieces as the model produces them."""
+    backend = pool.acquire(affinity)
+    error = None
+    try:
+        for chunk in chains.get()[backend.url].stream({"conversation": conversation}):
+            yield chunk
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        # Also runs when the consumer stops early, which is not the backend's fault
+        pool.release(backend, success=error is None, error=error)
 
 
 
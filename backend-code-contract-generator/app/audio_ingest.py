@@ -0,0 +1,217 @@
+# --- backend/app/audio_ingest.py ---
+# Uploads are piped through ffmpeg as they arrive and decoded straight into
+# one 16 kHz mono float32 buffer that Whisper and pyannote both read.
+import hashlib
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from app.transcript_cache import AUDIO_DIR
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 500 * 1024 * 1024))
+MAX_AUDIO_SECONDS = float(os.getenv("MAX_AUDIO_SECONDS", 3 * 3600))
+# Decoded audio longer than this goes to an unlinked temp file and is memory-mapped
+PCM_MEMMAP_SECONDS = float(os.getenv("PCM_MEMMAP_SECONDS", 1800))
+PCM_TEMP_DIR = os.getenv("PCM_TEMP_DIR") or None
+# Keep the raw upload in AUDIO_DIR as <sha256><ext>; not needed for transcription
+ARCHIVE_UPLOADS = os.getenv("ARCHIVE_UPLOADS", "false").lower() in ("1", "true", "yes")
+# Containers whose index may sit at the end of the file cannot be decoded from
+# a pipe; these are spooled to a temp file and decoded once complete
+UNSTREAMABLE_EXTENSIONS = {".mp4", ".m4a", ".mov", ".3gp", ".aac"}
+
+READ_BYTES = 64 * 1024
+BYTES_PER_SAMPLE = 4
+
+DecodedAudio = namedtuple('DecodedAudio', 'digest audio seconds archive_path decode_seconds')
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class AudioTooLong(Exception):
+    pass
+
+
+class AudioDecodeError(Exception):
+    pass
+
+
+class PcmBuffer:
+    """Grows in memory, then spills to an unlinked temp file read back as a memmap."""
+    def __init__(self, spill_bytes, directory=PCM_TEMP_DIR):
+        self.spill_bytes = spill_bytes
+        self.directory = directory
+        self.memory = bytearray()
+        self.file = None
+        self.size = 0
+
+    def write(self, data):
+        if self.file is None and self.size + len(data) > self.spill_bytes:
+            self.file = tempfile.TemporaryFile(dir=self.directory)
+            self.file.write(self.memory)
+            self.memory = bytearray()
+        if self.file is not None:
+            self.file.write(data)
+        else:
+            self.memory += data
+        self.size += len(data)
+
+    def array(self):
+        samples = self.size // BYTES_PER_SAMPLE
+        if samples == 0:
+            raise AudioDecodeError("No audio could be decoded from the upload")
+        if self.file is None:
+            return np.frombuffer(self.memory, dtype=np.float32, count=samples)
+        self.file.flush()
+        # Copy-on-write: callers may modify the array without touching the file
+        return np.memmap(self.file, dtype=np.float32, mode="c", shape=(samples,))
+
+
+class AudioDecoder:
+    """
+    Feed upload chunks with feed() (blocking; call from a worker thread),
+    then finish() for the decoded waveform. Limits are checked as data
+    arrives, so an oversized or overlong upload fails before it is fully read.
+    """
+    def __init__(self, filename, max_bytes=MAX_UPLOAD_BYTES, max_seconds=MAX_AUDIO_SECONDS,
+                 archive=ARCHIVE_UPLOADS, archive_dir=AUDIO_DIR):
+        self.filename = filename or "upload"
+        self.ext = os.path.splitext(self.filename)[1].lower()
+        self.max_bytes = max_bytes
+        self.max_samples = int(max_seconds * SAMPLE_RATE)
+        self.archive_dir = archive_dir
+        self.sha = hashlib.sha256()
+        self.bytes = 0
+        self.started = time.time()
+        self.pcm = PcmBuffer(int(PCM_MEMMAP_SECONDS * SAMPLE_RATE * BYTES_PER_SAMPLE))
+        self.error = None
+        self.process = None
+        self.reader = None
+        self.stderr = tempfile.TemporaryFile()
+
+        self.raw = None
+        self.streaming = self.ext not in UNSTREAMABLE_EXTENSIONS
+        if archive or not self.streaming:
+            os.makedirs(archive_dir, exist_ok=True)
+            fd, self.raw_path = tempfile.mkstemp(dir=archive_dir, suffix=".part")
+            self.raw = os.fdopen(fd, "wb")
+        self.archive = archive
+        if self.streaming:
+            self._start("pipe:0")
+
+    def _start(self, source):
+        self.process = subprocess.Popen(
+            ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", source,
+             "-f", "f32le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"],
+            stdin=subprocess.PIPE if source == "pipe:0" else subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=self.stderr,
+        )
+        self.reader = threading.Thread(target=self._read_output, name="audio-decode", daemon=True)
+        self.reader.start()
+
+    def _read_output(self):
+        while True:
+            data = self.process.stdout.read(READ_BYTES)
+            if not data:
+                return
+            self.pcm.write(data)
+            if self.pcm.size // BYTES_PER_SAMPLE > self.max_samples:
+                self.error = AudioTooLong(f"Audio is longer than {self.max_samples // SAMPLE_RATE} seconds")
+                self.process.kill()
+                return
+
+    def feed(self, chunk):
+        if self.error is not None:
+            raise self.error
+        self.bytes += len(chunk)
+        if self.bytes > self.max_bytes:
+            self.error = UploadTooLarge(f"Upload is larger than {self.max_bytes} bytes")
+            raise self.error
+        self.sha.update(chunk)
+        if self.raw is not None:
+            self.raw.write(chunk)
+        if self.streaming:
+            try:
+                self.process.stdin.write(chunk)
+            except BrokenPipeError:
+                # ffmpeg gave up (bad data, or killed for exceeding the duration limit)
+                raise self.error or AudioDecodeError(self._ffmpeg_error())
+
+    def _ffmpeg_error(self):
+        self.stderr.seek(0)
+        message = self.stderr.read().decode("utf-8", "replace").strip()
+        return message.splitlines()[-1] if message else "ffmpeg could not decode the upload"
+
+    def finish(self):
+        """Waits for decoding to end and returns a DecodedAudio."""
+        try:
+            digest = self.sha.hexdigest()
+            if self.raw is not None:
+                self.raw.close()
+            if self.streaming:
+                try:
+                    self.process.stdin.close()
+                except BrokenPipeError:
+                    pass
+            else:
+                self._start(self.raw_path)
+            self.reader.join()
+            returncode = self.process.wait()
+            if self.error is not None:
+                raise self.error
+            if returncode != 0:
+                raise AudioDecodeError(self._ffmpeg_error())
+
+            audio = self.pcm.array()
+            archive_path = self._keep_raw(digest) if self.archive else None
+        finally:
+            self.abort()
+
+        seconds = len(audio) / SAMPLE_RATE
+        decode_seconds = round(time.time() - self.started, 2)
+        logger.info(f"Decoded {self.filename} ({self.bytes} bytes, {seconds:.0f}s of audio) in {decode_seconds}s")
+        return DecodedAudio(digest, audio, seconds, archive_path, decode_seconds)
+
+    def _keep_raw(self, digest):
+        path = os.path.join(self.archive_dir, f"{digest}{self.ext}")
+        if os.path.exists(path):
+            os.remove(self.raw_path)
+        else:
+            os.replace(self.raw_path, path)
+        return path
+
+    def abort(self):
+        """Stops ffmpeg and removes temporary files; safe to call more than once."""
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        if self.raw is not None:
+            self.raw.close()
+            if os.path.exists(self.raw_path):
+                os.remove(self.raw_path)
+        self.stderr.close()
+
+
+def decode_upload(source, filename, **limits):
+    """Decodes a file-like upload chunk by chunk; blocking."""
+    decoder = AudioDecoder(filename, **limits)
+    try:
+        while True:
+            chunk = source.read(READ_BYTES)
+            if not chunk:
+                break
+            decoder.feed(chunk)
+        return decoder.finish()
+    except BaseException:
+        decoder.abort()
+        raise
@@ -0,0 +1,221 @@
+# --- backend/app/chunked_transcribe.py ---
+# Long recordings are cut at pauses into overlapping chunks, transcribed in
+# parallel worker processes, and stitched back onto one timeline. Kept apart
+# from whisper_utils so worker processes import only Whisper, not pyannote.
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from app.models import load_whisper, whisper_options
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000  # whisper.load_audio always resamples to 16 kHz
+
+# Recordings at least this long are chunked; shorter ones go through one call
+LONG_AUDIO_SECONDS = float(os.getenv("LONG_AUDIO_SECONDS", 600))
+CHUNK_SECONDS = float(os.getenv("CHUNK_SECONDS", 120))
+# Audio shared by neighbouring chunks on each side of a cut
+CHUNK_OVERLAP_SECONDS = float(os.getenv("CHUNK_OVERLAP_SECONDS", 2))
+# How far either side of the nominal cut to look for the quietest moment
+SILENCE_SEARCH_SECONDS = float(os.getenv("SILENCE_SEARCH_SECONDS", 10))
+# Each worker process loads its own copy of the Whisper model, so memory
+# grows with this (times MODEL_SERVER_SLOTS under the model server)
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", 2))
+# Words this close in time with the same text on both sides of a cut are one word
+DUPLICATE_WORD_SECONDS = float(os.getenv("DUPLICATE_WORD_SECONDS", 0.5))
+
+FRAME_SECONDS = 0.03
+
+_pool = None
+_pool_model = None
+_pool_lock = threading.Lock()
+_worker_model = None
+_pools_sharing = 1
+
+
+def share_cores(pools):
+    """
+    Called in each of several processes that may chunk at the same time
+    (the model server's inference slots), so their pools together stay
+    within the machine's cores.
+    """
+    global _pools_sharing
+    _pools_sharing = max(1, pools)
+
+
+def worker_count():
+    return max(1, min(TRANSCRIBE_WORKERS, (os.cpu_count() or 1) // _pools_sharing))
+
+
+def should_chunk(audio, sample_rate=SAMPLE_RATE):
+    return worker_count() > 1 and len(audio) >= LONG_AUDIO_SECONDS * sample_rate
+
+
+def quietest_point(audio, lo, hi, sample_rate=SAMPLE_RATE):
+    """Sample index of the lowest-energy frame in audio[lo:hi]."""
+    frame = int(FRAME_SECONDS * sample_rate)
+    frames = (hi - lo) // frame
+    if frames < 1:
+        return (lo + hi) // 2
+    window = audio[lo:lo + frames * frame].reshape(frames, frame)
+    energy = np.sqrt(np.mean(window.astype(np.float32) ** 2, axis=1))
+    return lo + int(np.argmin(energy)) * frame + frame // 2
+
+
+def plan_chunks(audio, sample_rate=SAMPLE_RATE, chunk_seconds=CHUNK_SECONDS,
+                overlap_seconds=CHUNK_OVERLAP_SECONDS, search_seconds=SILENCE_SEARCH_SECONDS):
+    """
+    Returns [(start, end, cut)] in samples. Each cut sits at a pause near a
+    multiple of chunk_seconds; neighbouring chunks both cover overlap_seconds
+    either side of it. The last chunk's cut is the end of the audio.
+    """
+    total = len(audio)
+    chunk = int(chunk_seconds * sample_rate)
+    overlap = int(overlap_seconds * sample_rate)
+    search = min(int(search_seconds * sample_rate), chunk // 4)
+
+    chunks = []
+    start = 0
+    previous_cut = 0
+    while total - previous_cut > chunk + search:
+        target = previous_cut + chunk
+        cut = quietest_point(audio, target - search, target + search, sample_rate)
+        chunks.append((start, min(total, cut + overlap), cut))
+        start = max(0, cut - overlap)
+        previous_cut = cut
+    chunks.append((start, total, total))
+    return chunks
+
+
+def _init_worker(model_name, threads):
+    global _worker_model
+    import torch
+
+    # Several processes share the cores; don't let each one claim them all
+    torch.set_num_threads(threads)
+    _worker_model = load_whisper(model_name)
+
+
+def _transcribe_chunk(audio, offset, language):
+    result = _worker_model.transcribe(audio, word_timestamps=True, language=language, **whisper_options())
+    segments = result.get('segments', [])
+    for segment in segments:
+        segment['start'] += offset
+        segment['end'] += offset
+        for word in segment.get('words', []):
+            word['start'] += offset
+            word['end'] += offset
+    return segments, result.get('language')
+
+
+def _get_pool(model_name):
+    global _pool, _pool_model
+    with _pool_lock:
+        if _pool is None or _pool_model != model_name:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            workers = worker_count()
+            threads = max(1, (os.cpu_count() or 1) // (workers * _pools_sharing))
+            # spawn: forking a process that already holds torch state is unsafe
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(model_name, threads),
+            )
+            _pool_model = model_name
+            logger.info(f"Started {workers} Whisper worker processes ({threads} threads each)")
+        return _pool
+
+
+def _reset_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+
+
+def _normalize(text):
+    return re.sub(r"[^\w']", "", text.lower())
+
+
+def _is_duplicate(word, kept):
+    text = _normalize(word.get('word', ''))
+    for other in reversed(kept):
+        if word['start'] - other['start'] > DUPLICATE_WORD_SECONDS:
+            break
+        if abs(word['start'] - other['start']) <= DUPLICATE_WORD_SECONDS and _normalize(other.get('word', '')) == text:
+            return True
+    return False
+
+
+def stitch(chunks, results, sample_rate=SAMPLE_RATE):
+    """
+    Merges per-chunk segments into one Whisper-style result. Words are taken
+    from the chunk that owns their start time (before its cut, after the
+    previous one); a word repeated just past a cut is dropped.
+    """
+    segments = []
+    kept_words = []
+    previous_cut = 0.0
+    for (_, _, cut), (chunk_segments, _) in zip(chunks, results):
+        cut_seconds = cut / sample_rate
+        is_last = cut == chunks[-1][2]
+        for segment in chunk_segments:
+            words = []
+            for word in segment.get('words', []):
+                if word['start'] < previous_cut or (word['start'] >= cut_seconds and not is_last):
+                    continue
+                if word['start'] < previous_cut + DUPLICATE_WORD_SECONDS and _is_duplicate(word, kept_words):
+                    continue
+                words.append(word)
+            if not words:
+                continue
+            kept_words.extend(words)
+            segments.append({
+                'id': len(segments),
+                'start': words[0]['start'],
+                'end': words[-1]['end'],
+                'text': "".join(word.get('word', '') for word in words),
+                'words': words,
+            })
+        previous_cut = cut_seconds
+
+    language = next((language for _, language in results if language), None)
+    return {
+        'text': "".join(segment['text'] for segment in segments),
+        'segments': segments,
+        'language': language,
+    }
+
+
+def transcribe_long(audio, model_name, language=None):
+    """Whisper transcription of a 16 kHz waveform, chunked across worker processes."""
+    start = time.time()
+    chunks = plan_chunks(audio)
+    pool = _get_pool(model_name)
+    try:
+        futures = [
+            pool.submit(_transcribe_chunk, audio[lo:hi], lo / SAMPLE_RATE, language)
+            for lo, hi, _ in chunks
+        ]
+        results = [future.result() for future in futures]
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory); start a fresh pool next time
+        _reset_pool(pool)
+        raise
+
+    result = stitch(chunks, results)
+    logger.info(
+        f"Transcribed {len(audio) / SAMPLE_RATE:.0f}s of audio in {len(chunks)} chunks "
+        f"on {worker_count()} workers in {time.time() - start:.1f}s"
+    )
+    return result
@@ -0,0 +1,198 @@
+# --- backend/app/jobs.py ---
+import asyncio
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Worker threads per pipeline stage. Transcription holds the Whisper and
+# pyannote models, so it defaults to one job at a time.
+STAGE_CONCURRENCY = {
+    "transcribe": int(os.getenv("TRANSCRIBE_CONCURRENCY", 1)),
+    "generate": int(os.getenv("GENERATE_CONCURRENCY", 2)),
+    "render": int(os.getenv("RENDER_CONCURRENCY", 2)),
+}
+MAX_ACTIVE_JOBS = int(os.getenv("MAX_ACTIVE_JOBS", 20))
+# Finished jobs are kept this long for polling
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", 3600))
+
+FINISHED = ("completed", "failed")
+
+
+class TooManyJobs(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.status = "queued"
+        self.stage = None
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.timings = {}
+        self.output = []  # text streamed by a stage while it runs
+        self.version = 0
+        self.changed = asyncio.Event()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED
+
+    def update(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.updated_at = time.time()
+        self.version += 1
+        self._notify()
+
+    def append_output(self, text):
+        # Wakes watchers without bumping version: status watchers ignore it
+        self.output.append(text)
+        self._notify()
+
+    def _notify(self):
+        # Wake every watcher, then re-arm for the next change
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": round(self.progress, 2),
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "stage_seconds": self.timings,
+            "error": self.error,
+            "result": self.result,
+        }
+
+
+class JobManager:
+    """
+    Runs multi-stage jobs as asyncio tasks; each blocking stage runs on its
+    own thread pool so the event loop stays free and stages have separate
+    concurrency limits. Must be used from the event loop thread.
+    """
+    def __init__(self, stage_concurrency=None, max_active=MAX_ACTIVE_JOBS, retention=JOB_RETENTION_SECONDS):
+        self.stage_concurrency = dict(stage_concurrency or STAGE_CONCURRENCY)
+        self.executors = {
+            stage: ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"job-{stage}")
+            for stage, workers in self.stage_concurrency.items()
+        }
+        self.max_active = max_active
+        self.retention = retention
+        self.jobs = {}
+        self.tasks = set()
+
+    def submit(self, name, pipeline, *args):
+        """Starts pipeline(job, *args) in the background and returns the job."""
+        self._purge()
+        active = sum(1 for job in self.jobs.values() if not job.finished)
+        if active >= self.max_active:
+            raise TooManyJobs()
+
+        job = Job(name)
+        self.jobs[job.id] = job
+        task = asyncio.get_running_loop().create_task(self._run(job, pipeline, args))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        logger.info(f"Job {job.id} ({name}) queued")
+        return job
+
+    async def _run(self, job, pipeline, args):
+        try:
+            result = await pipeline(job, *args)
+            job.update(status="completed", stage=None, progress=1.0, result=result)
+            logger.info(f"Job {job.id} completed in {time.time() - job.created_at:.1f}s")
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed")
+            job.update(status="failed", error=str(e))
+
+    async def run_stage(self, job, stage, progress, fn, *args):
+        """Runs fn(*args) on the stage's pool; progress is the fraction reached when it ends."""
+        job.update(status="running", stage=stage)
+        start = time.time()
+        result = await asyncio.get_running_loop().run_in_executor(self.executors[stage], fn, *args)
+        job.timings[stage] = round(time.time() - start, 2)
+        job.update(progress=progress)
+        return result
+
+    async def run_streaming_stage(self, job, stage, progress, fn, *args):
+        """
+        Like run_stage for a generator fn: each chunk it yields is appended to
+        job.output as it arrives. Returns the chunks joined.
+        """
+        loop = asyncio.get_running_loop()
+
+        def consume():
+            parts = []
+            for chunk in fn(*args):
+                parts.append(chunk)
+                loop.call_soon_threadsafe(job.append_output, chunk)
+            return "".join(parts)
+
+        return await self.run_stage(job, stage, progress, consume)
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    async def wait(self, job):
+        while not job.finished:
+            await job.changed.wait()
+        return job
+
+    async def watch(self, job):
+        """Yields the job each time it changes, ending once it has finished."""
+        version = -1
+        while True:
+            changed = job.changed
+            if job.version != version:
+                version = job.version
+                yield job
+            if job.finished:
+                return
+            await changed.wait()
+
+    async def stream(self, job):
+        """
+        Yields ("state", job) on each status change and ("output", text) for
+        newly streamed text, ending once the job has finished.
+        """
+        version = -1
+        position = 0
+        while True:
+            changed = job.changed
+            # Text first, so the final state comes after the last of it
+            if position < len(job.output):
+                text = "".join(job.output[position:])
+                position = len(job.output)
+                yield "output", text
+            if job.version != version:
+                version = job.version
+                yield "state", job
+            if job.finished:
+                return
+            await changed.wait()
+
+    def _purge(self):
+        cutoff = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished and job.updated_at < cutoff]:
+            del self.jobs[job_id]
+
+    def stats(self):
+        return {
+            "jobs": len(self.jobs),
+            "active": sum(1 for job in self.jobs.values() if not job.finished),
+            "max_active": self.max_active,
+            "stage_concurrency": self.stage_concurrency,
+        }
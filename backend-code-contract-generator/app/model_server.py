@@ -0,0 +1,272 @@
+# --- backend/app/model_server.py ---
+# A local inference server that owns Whisper and pyannote, so several
+# uvicorn workers share MODEL_SERVER_SLOTS copies of the models instead of
+# each loading their own. HTTP workers put the decoded waveform in shared
+# memory and send only its name over the connection.
+#
+#   MODEL_SERVER_AUTHKEY=... python -m app.model_server
+#   MODEL_SERVER_ADDRESS=/tmp/contract-models.sock MODEL_SERVER_AUTHKEY=... uvicorn main:app --workers 4
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import resource_tracker
+from multiprocessing.managers import BaseManager
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from app.models import DISABLED, READY
+
+logger = logging.getLogger(__name__)
+
+# Unix socket path, or host:port. HTTP workers use the server only when this is set.
+MODEL_SERVER_ADDRESS = os.getenv("MODEL_SERVER_ADDRESS", "")
+MODEL_SERVER_AUTHKEY = os.getenv("MODEL_SERVER_AUTHKEY", "")
+# Inference processes, each with its own copy of the models
+MODEL_SERVER_SLOTS = int(os.getenv("MODEL_SERVER_SLOTS", 1))
+# Longest a transcription may take before the caller gives up on it
+MODEL_SERVER_TIMEOUT = float(os.getenv("MODEL_SERVER_TIMEOUT", 3 * 3600))
+DEFAULT_SOCKET = "/tmp/contract-models.sock"
+
+
+def parse_address(address):
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and not address.startswith("/"):
+        return host or "127.0.0.1", int(port)
+    return address
+
+
+def authkey():
+    # Requests are pickled, so anyone able to connect could run code: never default this
+    if not MODEL_SERVER_AUTHKEY:
+        raise RuntimeError("MODEL_SERVER_AUTHKEY must be set to use the model server")
+    return MODEL_SERVER_AUTHKEY.encode("utf-8")
+
+
+def attach(name):
+    """Opens shared memory created by another process without taking ownership of it."""
+    shm = SharedMemory(name=name)
+    # Before Python 3.13 attaching registers the block with this process's
+    # resource tracker, which would unlink it when this process exits
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def _inference_worker(index, slots, tasks, results):
+    """Runs in each inference process: loads the models, then serves tasks."""
+    logging.basicConfig(level=logging.INFO)
+    from app import chunked_transcribe, models
+    from app.whisper_utils import transcribe_audio
+
+    # Every slot may chunk a long recording at once; split the cores between them
+    chunked_transcribe.share_cores(slots)
+    models.warm_up()
+    results.put(("status", index, None, models.status()))
+    while True:
+        task_id, shm_name, samples = tasks.get()
+        results.put(("started", index, task_id, None))
+        try:
+            shm = attach(shm_name)
+            try:
+                audio = np.ndarray((samples,), dtype=np.float32, buffer=shm.buf)
+                timings, details = {}, {}
+                transcript = transcribe_audio(audio, timings, details)
+                payload = (transcript, timings, details)
+                del audio
+            finally:
+                shm.close()
+            results.put(("done", index, task_id, payload))
+        except Exception as e:
+            logger.exception(f"Transcription task {task_id} failed")
+            results.put(("failed", index, task_id, str(e)))
+        results.put(("status", index, None, models.status()))
+
+
+class Dispatcher:
+    """
+    Lives in the server process. transcribe() is called from the manager's
+    per-connection threads; tasks go to the inference processes over a
+    multiprocessing queue and replies are matched back by task id.
+    """
+    def __init__(self, slots=MODEL_SERVER_SLOTS):
+        self.context = multiprocessing.get_context("spawn")
+        self.tasks = self.context.Queue()
+        self.results = self.context.Queue()
+        self.slots = slots
+        self.processes = [None] * slots
+        self.current = [None] * slots
+        self.statuses = [None] * slots
+        self.pending = {}
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.stopping = False
+        for index in range(slots):
+            self._start_worker(index)
+        threading.Thread(target=self._collect, name="model-results", daemon=True).start()
+        threading.Thread(target=self._supervise, name="model-supervisor", daemon=True).start()
+
+    def _start_worker(self, index):
+        # Not daemonic: long recordings start their own chunk worker processes
+        process = self.context.Process(
+            target=_inference_worker, args=(index, self.slots, self.tasks, self.results), name=f"inference-{index}",
+        )
+        process.start()
+        self.processes[index] = process
+        logger.info(f"Started inference process {index} (pid {process.pid})")
+
+    def _collect(self):
+        while True:
+            kind, index, task_id, payload = self.results.get()
+            with self.lock:
+                if kind == "status":
+                    self.statuses[index] = payload
+                    continue
+                if kind == "started":
+                    self.current[index] = task_id
+                    continue
+                self.current[index] = None
+                future = self.pending.pop(task_id, None)
+            if future is None:
+                continue
+            if kind == "done":
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+
+    def _supervise(self):
+        # A worker killed mid-task (e.g. out of memory) must not leave its caller waiting
+        while True:
+            time.sleep(1)
+            with self.lock:
+                if self.stopping:
+                    return
+                for index, process in enumerate(self.processes):
+                    if process.is_alive():
+                        continue
+                    logger.error(f"Inference process {index} exited with code {process.exitcode}; restarting")
+                    future = self.pending.pop(self.current[index], None)
+                    self.current[index] = None
+                    self.statuses[index] = None
+                    if future is not None:
+                        future.set_exception(RuntimeError("Inference process died during transcription"))
+                    self._start_worker(index)
+
+    def transcribe(self, shm_name, samples):
+        """(transcript, timings, details) for float32 audio in the named shared memory."""
+        future = Future()
+        with self.lock:
+            task_id = next(self.ids)
+            self.pending[task_id] = future
+        self.tasks.put((task_id, shm_name, samples))
+        try:
+            return future.result(timeout=MODEL_SERVER_TIMEOUT)
+        finally:
+            with self.lock:
+                self.pending.pop(task_id, None)
+
+    def shutdown(self):
+        with self.lock:
+            self.stopping = True
+            for process in self.processes:
+                process.terminate()
+            for process in self.processes:
+                process.join()
+
+    def status(self):
+        with self.lock:
+            return {
+                "slots": self.slots,
+                "busy": sum(1 for task_id in self.current if task_id is not None),
+                "queued": len(self.pending) - sum(1 for task_id in self.current if task_id is not None),
+                "workers": [
+                    {"pid": process.pid, "alive": process.is_alive(), "models": models}
+                    for process, models in zip(self.processes, self.statuses)
+                ],
+            }
+
+
+class ModelServerManager(BaseManager):
+    pass
+
+
+class ModelClient:
+    """Used by HTTP workers in place of whisper_utils.transcribe_audio."""
+    def __init__(self, address=MODEL_SERVER_ADDRESS):
+        self.address = parse_address(address)
+        self.lock = threading.Lock()
+        self.dispatcher = None
+
+    def _connect(self):
+        with self.lock:
+            if self.dispatcher is None:
+                manager = ModelServerManager(address=self.address, authkey=authkey())
+                manager.connect()
+                self.dispatcher = manager.dispatcher()
+            return self.dispatcher
+
+    def _call(self, method, *args):
+        try:
+            return getattr(self._connect(), method)(*args)
+        except (ConnectionError, EOFError):
+            # Server restarted: reconnect once
+            with self.lock:
+                self.dispatcher = None
+            return getattr(self._connect(), method)(*args)
+
+    def transcribe_audio(self, audio, timings: dict = None, details: dict = None) -> str:
+        """Same contract as whisper_utils.transcribe_audio, for a decoded waveform."""
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        shm = SharedMemory(create=True, size=max(1, audio.nbytes))
+        try:
+            np.ndarray(audio.shape, dtype=np.float32, buffer=shm.buf)[:] = audio
+            transcript, remote_timings, remote_details = self._call("transcribe", shm.name, len(audio))
+        finally:
+            shm.close()
+            shm.unlink()
+        if timings is not None:
+            timings.update(remote_timings)
+        if details is not None:
+            details.update(remote_details)
+        return transcript
+
+    def status(self):
+        try:
+            status = self._call("status")
+        except Exception as e:
+            return {"reachable": False, "error": str(e), "ready": False}
+        ready = any(
+            worker["models"] and all(model["state"] in (READY, DISABLED) for model in worker["models"].values())
+            for worker in status["workers"]
+        )
+        return dict(status, reachable=True, ready=ready)
+
+
+def serve(address=MODEL_SERVER_ADDRESS or DEFAULT_SOCKET, slots=MODEL_SERVER_SLOTS):
+    address = parse_address(address)
+    key = authkey()
+    if isinstance(address, str) and os.path.exists(address):
+        os.remove(address)
+    dispatcher = Dispatcher(slots)
+    ModelServerManager.register("dispatcher", callable=lambda: dispatcher)
+    manager = ModelServerManager(address=address, authkey=key)
+    server = manager.get_server()
+    if isinstance(address, str):
+        os.chmod(address, 0o600)
+    logger.info(f"Model server listening on {address} with {slots} inference slot(s)")
+    try:
+        server.serve_forever()
+    finally:
+        dispatcher.shutdown()
+
+
+# Clients only need the name; the server registers it with the real callable
+ModelServerManager.register("dispatcher")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    serve()
@@ -0,0 +1,131 @@
+# --- backend/app/models.py ---
+# Models are loaded on first use (or by warm_up), not at import, so the
+# server starts in about a second and heavy libraries are imported lazily.
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# tiny, base, small, medium, large...
+WHISPER_MODEL_NAME = os.getenv("WHISPER_MODEL", "base")
+# "auto" picks CUDA when available
+WHISPER_DEVICE = os.getenv("WHISPER_DEVICE", "auto")
+# float32, float16 (GPU only) or int8 (CPU only, dynamically quantized)
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "float32")
+DIARIZATION_MODEL_NAME = os.getenv("DIARIZATION_MODEL", "pyannote/speaker-diarization-3.1")
+DIARIZATION_DEVICE = os.getenv("DIARIZATION_DEVICE", "auto")
+# Identifies what produced a transcript, for cache entries
+TRANSCRIPTION_MODEL = f"whisper-{WHISPER_MODEL_NAME}-{WHISPER_COMPUTE_TYPE}+{DIARIZATION_MODEL_NAME}"
+# Start loading every model in the background as soon as the server starts
+WARM_UP_ON_STARTUP = os.getenv("WARM_UP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+NOT_LOADED, LOADING, READY, FAILED, DISABLED = "not_loaded", "loading", "ready", "failed", "disabled"
+
+
+def resolve_device(device):
+    import torch
+
+    if device == "auto":
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    return device
+
+
+def load_whisper(name=WHISPER_MODEL_NAME, device=WHISPER_DEVICE, compute_type=WHISPER_COMPUTE_TYPE):
+    """Loads a Whisper model; also used by the chunked-transcription worker processes."""
+    import torch
+    import whisper
+
+    device = resolve_device(device)
+    model = whisper.load_model(name, device=device)
+    if compute_type == "int8":
+        if device != "cpu":
+            raise ValueError("WHISPER_COMPUTE_TYPE=int8 is only supported on CPU")
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif compute_type == "float16" and device == "cpu":
+        raise ValueError("WHISPER_COMPUTE_TYPE=float16 needs a GPU")
+    return model
+
+
+def whisper_options(compute_type=WHISPER_COMPUTE_TYPE):
+    # Whisper casts to half precision itself when fp16 is set
+    return {"fp16": compute_type == "float16"}
+
+
+class LazyModel:
+    """
+    A model loaded once, on the first get(), under a lock so concurrent
+    requests share one load. A failed load is retried on the next get().
+    """
+    def __init__(self, name, loader, description=None, enabled=True, reason=None):
+        self.name = name
+        self.loader = loader
+        self.description = description or name
+        self.lock = threading.Lock()
+        self.value = None
+        self.state = NOT_LOADED if enabled else DISABLED
+        self.error = None if enabled else reason
+        self.load_seconds = None
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    def get(self):
+        """The loaded model; None when disabled. Raises if loading fails."""
+        if self.state in (READY, DISABLED):
+            return self.value
+        with self.lock:
+            if self.state == READY:
+                return self.value
+            self.state = LOADING
+            start = time.time()
+            logger.info(f"Loading {self.description}...")
+            try:
+                self.value = self.loader()
+            except Exception as e:
+                self.state = FAILED
+                self.error = str(e)
+                logger.error(f"Failed to load {self.description}: {e}", exc_info=True)
+                raise
+            self.load_seconds = round(time.time() - start, 2)
+            self.state = READY
+            self.error = None
+            logger.info(f"{self.description} loaded in {self.load_seconds}s")
+        return self.value
+
+    def status(self):
+        return {
+            "model": self.description,
+            "state": self.state,
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+        }
+
+
+MODELS = {}
+
+
+def register(model):
+    MODELS[model.name] = model
+    return model
+
+
+def warm_up(names=None):
+    """Loads the named models (all by default); failures are logged, not raised."""
+    for name in names or list(MODELS):
+        try:
+            MODELS[name].get()
+        except Exception:
+            pass
+
+
+def warm_up_in_background():
+    thread = threading.Thread(target=warm_up, name="model-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def status():
+    return {name: model.status() for name, model in MODELS.items()}
@@ -0,0 +1,79 @@
+# --- backend/app/speakers.py ---
+# Merging Whisper words with diarization turns. Standard library only.
+import os
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+# A word in a gap between turns goes to the nearest turn within this distance
+SPEAKER_MAX_GAP_SECONDS = float(os.getenv("SPEAKER_MAX_GAP_SECONDS", 2.0))
+
+UNKNOWN = 'UNKNOWN'
+
+
+class TurnIndex:
+    """
+    Speaker turns sorted by start, with a running maximum of their ends so
+    the turns overlapping any interval are found by bisection. Turns may
+    overlap each other (people talking over one another).
+    """
+    def __init__(self, turns):
+        self.turns = sorted(turns, key=lambda turn: turn['start'])
+        self.starts = [turn['start'] for turn in self.turns]
+        self.max_ends = []
+        self.max_end_index = []
+        best = None
+        for index, turn in enumerate(self.turns):
+            if best is None or turn['end'] > self.turns[best]['end']:
+                best = index
+            self.max_ends.append(self.turns[best]['end'])
+            self.max_end_index.append(best)
+
+    def speaker(self, start, end, max_gap=SPEAKER_MAX_GAP_SECONDS):
+        """Speaker overlapping [start, end] the most, else the nearest one within max_gap."""
+        if not self.turns:
+            return UNKNOWN
+        end = max(start, end)
+        # Turns before lo all ended before the word; turns from hi on start after it
+        lo = bisect_left(self.max_ends, start)
+        hi = bisect_right(self.starts, end)
+
+        overlap = defaultdict(float)
+        for turn in self.turns[lo:hi]:
+            if turn['end'] >= start:
+                overlap[turn['speaker']] += min(end, turn['end']) - max(start, turn['start'])
+        if overlap:
+            # Ties go to whichever speaker appeared first (dicts keep insertion order)
+            return max(overlap, key=overlap.get)
+
+        # In a gap: the turn that ended last before the word, or the next one to start
+        candidates = []
+        if lo > 0:
+            before = self.turns[self.max_end_index[lo - 1]]
+            candidates.append((start - before['end'], before['speaker']))
+        if hi < len(self.turns):
+            after = self.turns[hi]
+            candidates.append((after['start'] - end, after['speaker']))
+        gap, speaker = min(candidates, key=lambda candidate: candidate[0])
+        return speaker if gap <= max_gap else UNKNOWN
+
+
+def assign_speakers(word_segments, speaker_turns, max_gap=SPEAKER_MAX_GAP_SECONDS):
+    """Sets word['speaker'] on every word of the Whisper segments."""
+    index = TurnIndex(speaker_turns)
+    for segment in word_segments:
+        for word in segment.get('words', []):
+            word['speaker'] = index.speaker(word['start'], word.get('end', word['start']), max_gap)
+
+
+def format_dialogue(word_segments):
+    """'**SPEAKER 00:** words...' paragraphs, one per change of speaker."""
+    parts = []
+    current_speaker = None
+    for segment in word_segments:
+        for word in segment.get('words', []):
+            if word['speaker'] != current_speaker:
+                parts.append(f"\n\n**{word['speaker'].replace('_', ' ')}:**")
+                current_speaker = word['speaker']
+            # The word's text is under 'word' and already starts with a space
+            parts.append(word.get('word', ''))
+    return "".join(parts).strip()
@@ -0,0 +1,166 @@
+# --- backend/app/transcript_cache.py ---
+# Content-addressed storage: uploads are named by their SHA-256, so a
+# re-uploaded recording maps to the same audio file and cached transcript.
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+AUDIO_DIR = os.getenv("AUDIO_DIR", "audio")
+TRANSCRIPT_CACHE_DIR = os.getenv("TRANSCRIPT_CACHE_DIR", os.path.join("cache", "transcripts"))
+# Least recently used transcripts are deleted once the cache grows past this
+TRANSCRIPT_CACHE_MAX_BYTES = int(os.getenv("TRANSCRIPT_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+
+CHUNK_BYTES = 1024 * 1024
+DIGEST_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+def store_audio(source, filename, directory=AUDIO_DIR):
+    """
+    Copies a file-like upload into directory as <sha256><ext>, hashing while
+    it copies. Returns (digest, path); an identical earlier upload is reused
+    and the new copy discarded.
+    """
+    os.makedirs(directory, exist_ok=True)
+    ext = os.path.splitext(filename or "")[1].lower()
+    sha = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = source.read(CHUNK_BYTES)
+                if not chunk:
+                    break
+                sha.update(chunk)
+                f.write(chunk)
+        digest = sha.hexdigest()
+        path = os.path.join(directory, f"{digest}{ext}")
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            logger.info(f"Upload {filename} matches stored audio {path}")
+        else:
+            os.replace(tmp_path, path)
+            logger.info(f"Saved upload {filename} to {path}")
+        return digest, path
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class TranscriptCache:
+    """
+    Transcripts and diarization turns on disk, one JSON file per audio
+    digest. Entries carry the model they were made with, so changing the
+    model turns old entries into misses. Reads refresh an entry's mtime,
+    which orders eviction.
+    """
+    def __init__(self, directory=TRANSCRIPT_CACHE_DIR, max_bytes=TRANSCRIPT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def get(self, digest, model=None):
+        if not DIGEST_PATTERN.fullmatch(digest):
+            return None
+        path = self._path(digest)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+            if model is not None and entry.get("model") != model:
+                raise KeyError(model)
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return entry
+
+    def put(self, digest, transcript, model, speaker_turns=None, **fields):
+        entry = dict(fields, digest=digest, model=model, transcript=transcript,
+                     speaker_turns=speaker_turns or [], created_at=time.time())
+        # Write then rename, so readers never see half a file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self._path(digest))
+        self.evict()
+        return entry
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        return entries
+
+    def evict(self):
+        with self.lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                total -= size
+                self.evictions += 1
+                logger.info(f"Evicted cached transcript {name}")
+
+    def stats(self):
+        entries = self._entries()
+        with self.lock:
+            return {
+                "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def remove_duplicate_audio(directory=AUDIO_DIR):
+    """
+    One-off migration for files saved before uploads were content-addressed:
+    renames each to <sha256><ext> and deletes copies of the same recording.
+    """
+    removed = 0
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path) or name.endswith(".part"):
+            continue
+        with open(path, "rb") as f:
+            digest, target = store_audio(f, name, directory)
+        if target != path:
+            os.remove(path)
+            removed += 1
+    logger.info(f"Removed or renamed {removed} audio files in {directory}")
+    return removed
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    remove_duplicate_audio()
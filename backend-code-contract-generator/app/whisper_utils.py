@@ -1,9 +1,15 @@
 # --- backend/app/whisper_utils.py ---
-import whisper
-from pyannote.audio import Pipeline
 import os
+import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from app.chunked_transcribe import SAMPLE_RATE, should_chunk, transcribe_long
+from app.speakers import assign_speakers, format_dialogue
+from app.models import (
+    LazyModel, register, load_whisper, whisper_options, resolve_device,
+    WHISPER_MODEL_NAME, WHISPER_DEVICE, WHISPER_COMPUTE_TYPE, DIARIZATION_MODEL_NAME, DIARIZATION_DEVICE,
+)
 
 # Setup logging
 logger = logging.getLogger(__name__)
@@ -13,54 +19,106 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 HUGGING_FACE_TOKEN = os.getenv("HUGGING_FACE_TOKEN")
 
-# --- Global Models ---
-# We load the models once when the application starts to save time on each request.
-whisper_model = None
-diarization_pipeline = None
+# Diarization runs here while Whisper runs on the caller's thread. One worker:
+# the pipeline is a single shared instance.
+diarization_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="diarize")
 
-# --- Initialize Models ---
-try:
-    # 1. Load the Whisper model for transcription
-    whisper_model = whisper.load_model("base")
-    logger.info("Whisper model 'base' loaded successfully.")
 
-    # 2. Load the Pyannote model for speaker diarization
-    if HUGGING_FACE_TOKEN:
-        diarization_pipeline = Pipeline.from_pretrained(
-            "pyannote/speaker-diarization-3.1",
-            use_auth_token=HUGGING_FACE_TOKEN
-        )
-        logger.info("Pyannote diarization pipeline loaded successfully.")
-    else:
-        logger.error("HUGGING_FACE_TOKEN not found. Diarization will not be available.")
+def load_diarization():
+    import torch
+    from pyannote.audio import Pipeline
 
-except Exception as e:
-    logger.error(f"Failed to load AI models: {e}", exc_info=True)
+    pipeline = Pipeline.from_pretrained(DIARIZATION_MODEL_NAME, use_auth_token=HUGGING_FACE_TOKEN)
+    if pipeline is None:
+        raise RuntimeError(f"Could not load {DIARIZATION_MODEL_NAME}; check HUGGING_FACE_TOKEN and the model's terms")
+    return pipeline.to(torch.device(resolve_device(DIARIZATION_DEVICE)))
 
 
-def transcribe_audio(audio_path: str) -> str:
+# --- Models ---
+# Loaded on first use or by the warm-up at startup, never at import.
+whisper_model = register(LazyModel(
+    "whisper", load_whisper, f"Whisper '{WHISPER_MODEL_NAME}' ({WHISPER_DEVICE}, {WHISPER_COMPUTE_TYPE})",
+))
+diarization_pipeline = register(LazyModel(
+    "diarization", load_diarization, f"pyannote '{DIARIZATION_MODEL_NAME}' ({DIARIZATION_DEVICE})",
+    enabled=bool(HUGGING_FACE_TOKEN), reason="HUGGING_FACE_TOKEN not set",
+))
+if not HUGGING_FACE_TOKEN:
+    logger.error("HUGGING_FACE_TOKEN not found. Diarization will not be available.")
+
+
+def transcribe_words(audio) -> dict:
+    """
+    Whisper result with word timestamps for a 16 kHz waveform. Long recordings
+    are split at pauses and transcribed in parallel worker processes.
     """
-    Transcribes an audio file and assigns speakers to each segment.
-    Returns a formatted dialogue string.
+    if should_chunk(audio):
+        return transcribe_long(audio, WHISPER_MODEL_NAME)
+    return whisper_model.get().transcribe(audio, word_timestamps=True, **whisper_options())
+
+
+def diarize(audio):
+    import torch
+
+    # pyannote takes an in-memory (channel, time) tensor instead of a path
+    return diarization_pipeline.get()({"waveform": torch.from_numpy(audio).unsqueeze(0), "sample_rate": SAMPLE_RATE})
+
+
+def timed(fn, *args):
+    start = time.time()
+    return fn(*args), round(time.time() - start, 2)
+
+
+def transcribe_audio(audio, timings: dict = None, details: dict = None) -> str:
     """
-    if whisper_model is None or diarization_pipeline is None:
-        logger.error("Cannot transcribe because one or more AI models failed to load.")
-        if whisper_model: # If only diarization failed, return a simple transcript
-            return whisper_model.transcribe(audio_path)["text"]
+    Transcribes audio (a file path, or a 16 kHz float32 waveform already
+    decoded at upload) and assigns speakers to each segment.
+    Returns a formatted dialogue string. Seconds spent decoding, diarizing
+    and transcribing are written to timings when given; the speaker turns
+    and language go into details, only when the full pipeline succeeded.
+    """
+    timings = {} if timings is None else timings
+    details = {} if details is None else details
+    try:
+        whisper_model.get()
+    except Exception:
+        logger.error("Cannot transcribe because the Whisper model failed to load.")
         return "Error: Transcription models not loaded."
 
-    logger.info(f"Starting diarization for: {audio_path}")
+    # Decode once; both stages read the same waveform
+    if isinstance(audio, str):
+        import whisper
+
+        try:
+            audio, timings["decode"] = timed(whisper.load_audio, audio)
+        except Exception as e:
+            logger.error(f"Error decoding audio: {e}", exc_info=True)
+            return f"Error processing audio: {e}"
+
     try:
-        # 1. Get speaker segments from the diarization pipeline
-        diarization = diarization_pipeline(audio_path)
-        
-        # 2. Get word-level timestamps from Whisper
-        whisper_result = whisper_model.transcribe(audio_path, word_timestamps=True)
+        diarization_available = diarization_pipeline.get() is not None
+    except Exception:
+        diarization_available = False
+    if not diarization_available:
+        logger.error("Cannot diarize because the diarization model failed to load.")
+        # If only diarization failed, return a simple transcript
+        whisper_result, timings["whisper"] = timed(transcribe_words, audio)
+        return whisper_result["text"]
+
+    logger.info(f"Starting diarization and transcription of {len(audio) / SAMPLE_RATE:.0f}s of audio")
+    try:
+        # 1. Speaker segments from the diarization pipeline, in the background
+        diarization_future = diarization_executor.submit(timed, diarize, audio)
+
+        # 2. Meanwhile, word-level timestamps from Whisper
+        whisper_result, timings["whisper"] = timed(transcribe_words, audio)
+        diarization, timings["diarize"] = diarization_future.result()
         
     except Exception as e:
         logger.error(f"Error during transcription or diarization: {e}", exc_info=True)
         return f"Error processing audio: {e}"
 
+    logger.info(f"Transcribed in {timings['whisper']}s, diarized in {timings['diarize']}s (concurrently)")
     logger.info("Combining transcription and diarization results...")
     
     # --- Combine Results ---
@@ -69,34 +127,11 @@ def transcribe_audio(audio_path: str) -> str:
         speaker_turns.append({'start': turn.start, 'end': turn.end, 'speaker': speaker})
 
     word_segments = whisper_result.get('segments', [])
-    
-    for segment in word_segments:
-        if 'words' not in segment: continue
-        for word in segment['words']:
-            word_start = word['start']
-            for turn in speaker_turns:
-                if turn['start'] <= word_start <= turn['end']:
-                    word['speaker'] = turn['speaker']
-                    break
-            if 'speaker' not in word:
-                word['speaker'] = 'UNKNOWN'
+    assign_speakers(word_segments, speaker_turns)
 
     # --- Format the Final Dialogue ---
-    full_transcript = ""
-    current_speaker = None
-
-    for segment in word_segments:
-        if 'words' not in segment: continue
-        for word in segment['words']:
-            if word['speaker'] != current_speaker:
-                full_transcript += f"\n\n**{word['speaker'].replace('_', ' ')}:**"
-                current_speaker = word['speaker']
-            
-            # --- THIS IS THE CORRECTED LINE ---
-            # The key for the word's text is 'word', not 'text'.
-            # We also add a space before each word for proper sentence structure.
-            word_text = word.get('word', '')
-            full_transcript += word_text
+    full_transcript = format_dialogue(word_segments)
+    details.update(speaker_turns=speaker_turns, language=whisper_result.get('language'))
 
     logger.info("Dialogue reconstruction complete.")
-    return full_transcript.strip()
+    return full_transcript
@@ -0,0 +1,85 @@
+"""
+Micro-benchmark for speaker assignment on a synthetic hour-long meeting.
+
+Compares the old word-by-turn scan with the bisect index in app/speakers.py.
+Run from this directory: python benchmark_speakers.py [minutes]
+"""
+import random
+import sys
+import time
+
+from app.speakers import assign_speakers, format_dialogue
+
+
+def synthetic_meeting(minutes, speakers=4, seed=7):
+    """Diarization turns with short gaps and overlaps, plus roughly two words a second."""
+    rng = random.Random(seed)
+    duration = minutes * 60.0
+    turns = []
+    t = 0.0
+    while t < duration:
+        length = rng.uniform(0.5, 8.0)
+        turns.append({'start': t, 'end': t + length, 'speaker': f"SPEAKER_{rng.randrange(speakers):02d}"})
+        # Mostly small gaps, sometimes someone starts before the last turn ends
+        t += length + rng.uniform(-0.4, 0.8)
+
+    segments = []
+    t = 0.0
+    while t < duration:
+        words = []
+        for _ in range(rng.randint(5, 20)):
+            length = rng.uniform(0.15, 0.6)
+            words.append({'word': " word", 'start': t, 'end': t + length})
+            t += length + rng.uniform(0.0, 0.3)
+        segments.append({'words': words})
+        t += rng.uniform(0.0, 1.5)
+    return segments, turns
+
+
+def naive(word_segments, speaker_turns):
+    # The previous implementation: every word against every turn, += strings
+    for segment in word_segments:
+        for word in segment['words']:
+            for turn in speaker_turns:
+                if turn['start'] <= word['start'] <= turn['end']:
+                    word['speaker'] = turn['speaker']
+                    break
+            if 'speaker' not in word:
+                word['speaker'] = 'UNKNOWN'
+
+    transcript = ""
+    current_speaker = None
+    for segment in word_segments:
+        for word in segment['words']:
+            if word['speaker'] != current_speaker:
+                transcript += f"\n\n**{word['speaker'].replace('_', ' ')}:**"
+                current_speaker = word['speaker']
+            transcript += word.get('word', '')
+    return transcript.strip()
+
+
+def indexed(word_segments, speaker_turns):
+    assign_speakers(word_segments, speaker_turns)
+    return format_dialogue(word_segments)
+
+
+def measure(fn, segments, turns):
+    fresh = [{'words': [dict(word) for word in segment['words']]} for segment in segments]
+    start = time.perf_counter()
+    fn(fresh, turns)
+    elapsed = time.perf_counter() - start
+    unknown = sum(1 for segment in fresh for word in segment['words'] if word['speaker'] == 'UNKNOWN')
+    return elapsed, unknown
+
+
+if __name__ == "__main__":
+    minutes = float(sys.argv[1]) if len(sys.argv) > 1 else 60
+    segments, turns = synthetic_meeting(minutes)
+    words = sum(len(segment['words']) for segment in segments)
+    print(f"{minutes:.0f} min: {words} words, {len(turns)} turns")
+
+    old, old_unknown = measure(naive, segments, turns)
+    new, new_unknown = measure(indexed, segments, turns)
+    print(f"naive scan:   {old * 1000:9.1f} ms  ({old_unknown} words UNKNOWN)")
+    print(f"bisect index: {new * 1000:9.1f} ms  ({new_unknown} words UNKNOWN)")
+    print(f"speedup:      {old / new:9.1f}x")
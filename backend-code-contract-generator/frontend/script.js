@@ -16,7 +16,9 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // This is the URL of your locally running FastAPI backend
     // IMPORTANT: Make sure the port number matches the one your server is running on.
-    const apiUrl = 'http://127.0.0.1:8001/generate_contract/';
+    // The /stream variant answers with Server-Sent Events, so the contract
+    // appears clause by clause while it is being written.
+    const apiUrl = 'http://127.0.0.1:8001/generate_contract/stream';
 
     // Listen for the form submission event
     uploadForm.addEventListener('submit', async (event) => {
@@ -34,6 +36,9 @@ document.addEventListener('DOMContentLoaded', () => {
         errorMessage.classList.add('hidden');
         submitButton.disabled = true;
         submitButton.textContent = 'Processing...';
+        transcriptText.textContent = '';
+        contractText.textContent = '';
+        pdfDownloadLink.classList.add('hidden');
 
         const formData = new FormData();
         formData.append('file', file);
@@ -44,27 +49,25 @@ document.addEventListener('DOMContentLoaded', () => {
                 body: formData,
             });
 
-            const data = await response.json();
-
-            // --- CRITICAL DEBUGGING STEP ---
-            // This will print the exact data your browser received to the developer console.
-            console.log('Data received from backend:', data);
-
             if (!response.ok) {
-                throw new Error(data.error || 'An unknown server error occurred.');
+                const data = await response.json();
+                throw new Error(data.detail || 'An unknown server error occurred.');
             }
 
-            // --- UI Updates: Populate results ---
-            // Check if the keys exist before trying to display them
-            transcriptText.textContent = data.transcript || "No transcript was returned.";
-            contractText.textContent = data.contract_text || "No contract text was returned.";
-            
-            if (data.pdf_path) {
-                const backendBaseUrl = 'http://127.0.0.1:8001';
-                pdfDownloadLink.href = backendBaseUrl + data.pdf_path;
+            // EventSource cannot POST a file, so the event stream is read by hand
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    handleEvent(buffer.slice(0, boundary));
+                    buffer = buffer.slice(boundary + 2);
+                }
             }
-            
-            resultsContainer.classList.remove('hidden');
 
         } catch (err) {
             console.error('Fetch error:', err);
@@ -77,6 +80,40 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    function handleEvent(block) {
+        let name = 'message';
+        let data = '';
+        for (const line of block.split('\n')) {
+            if (line.startsWith('event: ')) name = line.slice(7);
+            else if (line.startsWith('data: ')) data += line.slice(6);
+        }
+        const payload = JSON.parse(data);
+
+        if (name === 'contract') {
+            // First words of the contract: show the results instead of the spinner
+            loadingSpinner.classList.add('hidden');
+            resultsContainer.classList.remove('hidden');
+            contractText.textContent += payload.text;
+            return;
+        }
+        if (name === 'failed') {
+            throw new Error(payload.error || 'Contract generation failed.');
+        }
+
+        const result = payload.result || {};
+        if (result.transcript) {
+            transcriptText.textContent = result.transcript;
+        }
+        if (name === 'completed') {
+            contractText.textContent = result.contract_text || contractText.textContent || "No contract text was returned.";
+            if (result.pdf_url) {
+                pdfDownloadLink.href = result.pdf_url;
+                pdfDownloadLink.classList.remove('hidden');
+            }
+            resultsContainer.classList.remove('hidden');
+        }
+    }
+
     function showError(message) {
         errorText.textContent = message;
         errorMessage.classList.remove('hidden');
@@ -1,17 +1,31 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from app.whisper_utils import transcribe_audio
-from app.ai_utils import generate_contract
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from app.ai_utils import stream_contract
 from app.pdf_utils import save_contract_pdf
-import shutil, os, logging
+from app.jobs import JobManager, TooManyJobs
+from app import models
+from app.models import TRANSCRIPTION_MODEL
+from app.model_server import MODEL_SERVER_ADDRESS, ModelClient
+from app.transcript_cache import TranscriptCache
+from app.audio_ingest import AudioDecoder, decode_upload, UploadTooLarge, AudioTooLong, AudioDecodeError, MAX_UPLOAD_BYTES
+import os, logging, asyncio, json
 from datetime import datetime
 
 # Logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# With a model server, Whisper and pyannote live there and are shared by all
+# HTTP workers; otherwise each worker loads its own copy
+if MODEL_SERVER_ADDRESS:
+    model_client = ModelClient()
+    transcribe_audio = model_client.transcribe_audio
+else:
+    model_client = None
+    from app.whisper_utils import transcribe_audio
+
 app = FastAPI(title="Voice-to-Contract Generator")
 
 # CORS — list your actual frontends here
@@ -33,43 +47,251 @@ os.makedirs("audio", exist_ok=True)
 os.makedirs("contracts", exist_ok=True)
 
 
-@app.post("/generate_contract/")
-async def contract_from_audio(request: Request, file: UploadFile = File(...)):
+@app.on_event("startup")
+async def start_model_warm_up():
+    # Models load in the background; the server accepts requests immediately
+    if models.WARM_UP_ON_STARTUP:
+        models.warm_up_in_background()
+
+
+# Background jobs: Whisper, the LLM and PDF rendering run on worker threads
+jobs = JobManager()
+# Transcripts by audio content hash: re-uploads skip Whisper and pyannote
+transcripts = TranscriptCache()
+
+
+def ingest_error(e: Exception):
+    if isinstance(e, (UploadTooLarge, AudioTooLong)):
+        return HTTPException(status_code=413, detail=str(e))
+    return HTTPException(status_code=400, detail=f"Could not decode audio: {e}")
+
+
+async def ingest_upload(file: UploadFile):
+    # Decoded to 16 kHz PCM chunk by chunk; the raw file is only kept when archiving
+    try:
+        return await asyncio.to_thread(decode_upload, file.file, file.filename)
+    except (UploadTooLarge, AudioTooLong, AudioDecodeError) as e:
+        raise ingest_error(e)
+
+
+async def ingest_stream(request: Request, filename: str):
+    # Raw request body, decoded while it is still arriving
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > MAX_UPLOAD_BYTES:
+        raise ingest_error(UploadTooLarge(f"Upload is larger than {MAX_UPLOAD_BYTES} bytes"))
+
+    decoder = await asyncio.to_thread(AudioDecoder, filename)
     try:
-        # Save uploaded file with timestamp to avoid collisions
-        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        safe_name = file.filename.replace("/", "_").replace("\\", "_")
-        audio_path = os.path.join("audio", f"{ts}_{safe_name}")
+        async for chunk in request.stream():
+            if chunk:
+                await asyncio.to_thread(decoder.feed, chunk)
+        return await asyncio.to_thread(decoder.finish)
+    except (UploadTooLarge, AudioTooLong, AudioDecodeError) as e:
+        raise ingest_error(e)
+    finally:
+        await asyncio.to_thread(decoder.abort)
+
+
+async def transcribe_stage(job, audio_id: str, audio):
+    cached = await asyncio.to_thread(transcripts.get, audio_id, TRANSCRIPTION_MODEL)
+    if cached is not None:
+        logger.info(f"Using cached transcript for audio {audio_id}")
+        job.timings["transcribe"] = 0.0
+        job.update(progress=0.6, result={"audio_id": audio_id, "transcript": cached["transcript"], "cached": True})
+        return cached["transcript"]
+
+    timings, details = {}, {}
+    transcript = await jobs.run_stage(job, "transcribe", 0.6, transcribe_audio, audio, timings, details)
+    # Sub-stage breakdown: whisper and diarize ran side by side
+    job.timings.update({f"transcribe.{name}": seconds for name, seconds in timings.items()})
+    if details:
+        # Only complete results are cached, never error text or speakerless fallbacks
+        await asyncio.to_thread(transcripts.put, audio_id, transcript, TRANSCRIPTION_MODEL, **details)
+    job.update(result={"audio_id": audio_id, "transcript": transcript, "cached": False})
+    return transcript
 
-        with open(audio_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
-        logger.info(f"Saved upload to {audio_path}")
 
-        # Transcribe → generate contract
-        transcript = transcribe_audio(audio_path)
-        contract_text = generate_contract(transcript)
+async def contract_pipeline(job, decoded, ts: str):
+    # Transcribe → generate contract → save PDF, each on its stage's workers
+    job.timings["ingest"] = decoded.decode_seconds
+    audio_id = decoded.digest
+    transcript = await transcribe_stage(job, audio_id, decoded.audio)
+    return await contract_from_transcript(job, audio_id, transcript, ts, cached=job.result["cached"])
 
-        # Save PDF (✅ pass only filename, not full path)
-        pdf_filename = f"contract_{ts}.pdf"
-        pdf_path = save_contract_pdf(contract_text, filename=pdf_filename)
-        logger.info(f"PDF saved at {pdf_path}")
 
-        # ✅ Ensure frontend gets just the filename
-        pdf_filename = os.path.basename(pdf_path)
+async def contract_from_transcript(job, audio_id: str, transcript: str, ts: str, cached=True):
+    # Streamed: clients following contract_stream_url see each clause as it is written
+    contract_text = await jobs.run_streaming_stage(job, "generate", 0.9, stream_contract, transcript)
+    job.update(result={"audio_id": audio_id, "transcript": transcript, "cached": cached, "contract_text": contract_text})
 
+    # Job id in the name: two uploads in the same second must not share a PDF
+    pdf_path = await jobs.run_stage(job, "render", 1.0, save_contract_pdf, contract_text, f"contract_{ts}_{job.id[:8]}.pdf")
+    logger.info(f"PDF saved at {pdf_path}")
+
+    return {
+        "audio_id": audio_id,
+        "transcript": transcript,
+        "cached": cached,
+        "contract_text": contract_text,
+        "pdf_filename": os.path.basename(pdf_path),
+    }
+
+
+def submit_job(name, pipeline, *args):
+    try:
+        return jobs.submit(name, pipeline, *args)
+    except TooManyJobs:
+        raise HTTPException(status_code=503, detail="Too many contracts are being generated. Please try again shortly.")
+
+
+def start_contract_job(decoded):
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return submit_job("contract", contract_pipeline, decoded, ts)
+
+
+def job_response(request: Request, job):
+    data = job.to_dict()
+    result = data["result"]
+    if result and result.get("pdf_filename"):
         # Build absolute URL for frontend
-        contracts_url = request.url_for("contracts", path=pdf_filename)
-        return {
-            "message": "Contract generated successfully",
-            "transcript": transcript,
-            "contract_text": contract_text,
-            "pdf_url": str(contracts_url),  # frontend can fetch/download
-            "pdf_filename": pdf_filename,
-        }
-
-    except Exception as e:
-        logger.exception("Error in contract generation")
-        raise HTTPException(status_code=500, detail=str(e))
+        data["result"] = dict(result, pdf_url=str(request.url_for("contracts", path=result["pdf_filename"])))
+    data["status_url"] = str(request.url_for("job_status", job_id=job.id))
+    data["events_url"] = str(request.url_for("job_events", job_id=job.id))
+    data["contract_stream_url"] = str(request.url_for("job_contract_stream", job_id=job.id))
+    return data
+
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def event_stream(events):
+    return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+async def contract_events(request: Request, job):
+    # "progress" on each stage change, "contract" with each new piece of text,
+    # then "completed" (with pdf_url, once the PDF is built) or "failed"
+    async for kind, current in jobs.stream(job):
+        if kind == "output":
+            yield sse("contract", {"text": current})
+        else:
+            yield sse(current.status if current.finished else "progress", job_response(request, current))
+
+
+def get_job_or_404(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.post("/jobs/")
+async def create_contract_job(request: Request, file: UploadFile = File(...)):
+    """Queues the upload and returns at once; poll status_url or follow events_url."""
+    job = start_contract_job(await ingest_upload(file))
+    return JSONResponse(job_response(request, job), status_code=202)
+
+
+@app.post("/jobs/stream")
+async def create_contract_job_from_stream(request: Request, filename: str = "upload.webm"):
+    """Like /jobs/, but the request body is the raw audio, decoded as it streams in."""
+    job = start_contract_job(await ingest_stream(request, filename))
+    return JSONResponse(job_response(request, job), status_code=202)
+
+
+@app.get("/jobs/{job_id}", name="job_status")
+async def job_status(request: Request, job_id: str):
+    return job_response(request, get_job_or_404(job_id))
+
+
+@app.get("/jobs/{job_id}/events", name="job_events")
+async def job_events(request: Request, job_id: str):
+    """Server-Sent Events with the job's state on every change, ending when it finishes."""
+    job = get_job_or_404(job_id)
+
+    async def events():
+        async for current in jobs.watch(job):
+            yield sse(current.status if current.finished else "progress", job_response(request, current))
+
+    return event_stream(events())
+
+
+@app.get("/jobs/{job_id}/contract", name="job_contract_stream")
+async def job_contract_stream(request: Request, job_id: str):
+    """Server-Sent Events with the contract text as it is generated; see contract_events."""
+    return event_stream(contract_events(request, get_job_or_404(job_id)))
+
+
+@app.get("/jobs/")
+async def job_stats():
+    return dict(jobs.stats(), transcript_cache=await asyncio.to_thread(transcripts.stats))
+
+
+def get_transcript_or_404(audio_id: str):
+    cached = transcripts.get(audio_id, TRANSCRIPTION_MODEL)
+    if cached is None:
+        raise HTTPException(status_code=404, detail="No cached transcript for this audio")
+    return cached
+
+
+@app.get("/transcripts/{audio_id}")
+async def cached_transcript(audio_id: str):
+    return await asyncio.to_thread(get_transcript_or_404, audio_id)
+
+
+@app.post("/transcripts/{audio_id}/contract")
+async def regenerate_contract(request: Request, audio_id: str):
+    """Starts a contract job from a cached transcript, without the audio."""
+    cached = await asyncio.to_thread(get_transcript_or_404, audio_id)
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    job = submit_job("contract", contract_from_transcript, audio_id, cached["transcript"], ts)
+    return JSONResponse(job_response(request, job), status_code=202)
+
+
+@app.get("/ready")
+async def readiness():
+    """200 once every enabled model is loaded, 503 until then; lists each model's state."""
+    statuses = models.status()
+    ready = all(status["state"] in (models.READY, models.DISABLED) for status in statuses.values())
+    data = {"ready": ready, "models": statuses}
+    if model_client is not None:
+        data["model_server"] = await asyncio.to_thread(model_client.status)
+        data["ready"] = ready and data["model_server"]["ready"]
+    return JSONResponse(data, status_code=200 if data["ready"] else 503)
+
+
+@app.post("/models/warm_up")
+async def warm_up_models():
+    """Starts loading any model that is not loaded yet; poll /ready for progress."""
+    models.warm_up_in_background()
+    return JSONResponse({"models": models.status()}, status_code=202)
+
+
+@app.post("/generate_contract/")
+async def contract_from_audio(request: Request, file: UploadFile = File(...)):
+    # Same pipeline as /jobs/, but waits for the result (without blocking the event loop)
+    job = start_contract_job(await ingest_upload(file))
+    await jobs.wait(job)
+
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.error)
+
+    result = job_response(request, job)["result"]
+    return {
+        "message": "Contract generated successfully",
+        "transcript": result["transcript"],
+        "contract_text": result["contract_text"],
+        "pdf_url": result["pdf_url"],  # frontend can fetch/download
+        "pdf_filename": result["pdf_filename"],
+    }
+
+
+@app.post("/generate_contract/stream")
+async def contract_from_audio_stream(request: Request, file: UploadFile = File(...)):
+    """Same as /generate_contract/, but answers with Server-Sent Events as the contract is written."""
+    job = start_contract_job(await ingest_upload(file))
+    return event_stream(contract_events(request, job))
 
 
 @app.get("/download_contract/{filename}")
@@ -9,6 +9,15 @@ const onlineUsers = new Map();
 const AI_SERVICE_URL = "http://localhost:5001";
 const AI_USER_ID = 5; // The dedicated ID for the AI user from your database
 
+// Stable id for a chat so the AI service can keep a rolling summary of it
+const conversationId = (chatType, userId, chatId) => {
+  if (chatType === 'private') {
+    const [a, b] = [Number(userId), Number(chatId)].sort((x, y) => x - y);
+    return `private-${a}-${b}`;
+  }
+  return `group-${chatId}`;
+};
+
 const initializeSocket = (io) => {
   io.on('connection', (socket) => {
     console.log(`🔌 New connection: ${socket.id}`);
@@ -219,6 +228,7 @@ const initializeSocket = (io) => {
           headers: { 'Content-Type': 'application/json' },
           body: JSON.stringify({ 
             chat_data: chatHistory, 
+            conversation_id: conversationId(chatType, userId, chatId),
             user_prompt: "Please analyze this conversation and provide insights about the discussion, topics covered, and any notable patterns."
           }),
         });
@@ -353,7 +363,10 @@ async function handleAITagging(senderId, chatId, messageContent, chatType, io) {
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ 
           chat_data: chatHistory, 
-          user_prompt: question
+          conversation_id: conversationId(chatType, senderId, chatId),
+          user_prompt: question,
+          priority: 'interactive',
+          timeout_ms: 30000
         }),
         signal: controller.signal
       });
@@ -0,0 +1,174 @@
+# backend_pool.py - Load-balanced pool of Ollama servers
+# Shared by ai-service and the contract generator; standard library only.
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+# "least_outstanding" or "p2c" (power of two random choices)
+POOL_STRATEGY = os.getenv("OLLAMA_POOL_STRATEGY", "least_outstanding")
+POOL_CHECK_INTERVAL = float(os.getenv("OLLAMA_POOL_CHECK_INTERVAL", 10))
+POOL_CHECK_TIMEOUT = float(os.getenv("OLLAMA_POOL_CHECK_TIMEOUT", 3))
+# Consecutive failed requests before a backend is ejected, and for how long
+POOL_MAX_FAILURES = int(os.getenv("OLLAMA_POOL_MAX_FAILURES", 3))
+POOL_EJECT_SECONDS = float(os.getenv("OLLAMA_POOL_EJECT_SECONDS", 30))
+# A conversation stays on its backend unless that one has this many more
+# outstanding requests than the least loaded backend
+POOL_STICKY_SLACK = int(os.getenv("OLLAMA_POOL_STICKY_SLACK", 2))
+
+
+def parse_urls(spec):
+    return [url.strip().rstrip('/') for url in spec.split(',') if url.strip()]
+
+
+class Backend:
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.last_error = None
+
+    def available(self, now):
+        return now >= self.ejected_until
+
+    def stats(self, now):
+        return {
+            'url': self.url,
+            'available': self.available(now),
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'failures': self.failures,
+            'ejected_for_seconds': round(max(0.0, self.ejected_until - now), 1),
+            'last_error': self.last_error
+        }
+
+
+class BackendPool:
+    """
+    Spreads generations over several Ollama servers. Requests carrying an
+    affinity key (a conversation) go to the same backend via rendezvous
+    hashing so its prompt cache stays warm, unless that backend is ejected
+    or clearly busier than the rest. Backends are ejected after repeated
+    failures or a failed health check, and re-admitted once a check passes.
+    """
+    def __init__(self, urls, strategy=POOL_STRATEGY, check_interval=POOL_CHECK_INTERVAL,
+                 check_timeout=POOL_CHECK_TIMEOUT, max_failures=POOL_MAX_FAILURES,
+                 eject_seconds=POOL_EJECT_SECONDS, sticky_slack=POOL_STICKY_SLACK):
+        if isinstance(urls, str):
+            urls = parse_urls(urls)
+        if not urls:
+            raise ValueError("BackendPool needs at least one URL")
+        self.backends = [Backend(url.rstrip('/')) for url in urls]
+        self.strategy = strategy
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.sticky_slack = sticky_slack
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def urls(self):
+        return [backend.url for backend in self.backends]
+
+    @property
+    def primary(self):
+        return self.backends[0]
+
+    def start(self):
+        """Starts background health checks (only useful with more than one backend)."""
+        with self.lock:
+            if self.thread is not None or len(self.backends) < 2 or self.check_interval <= 0:
+                return
+            self.thread = threading.Thread(target=self._check_loop, name="ollama-pool", daemon=True)
+            self.thread.start()
+
+    def acquire(self, affinity=None):
+        """Picks a backend and counts a request against it; pair with release()."""
+        self.start()
+        now = time.time()
+        with self.lock:
+            # With everything ejected, trying anyway beats refusing outright
+            candidates = [b for b in self.backends if b.available(now)] or self.backends
+            backend = None
+            if affinity is not None and len(candidates) > 1:
+                preferred = max(candidates, key=lambda b: self._score(affinity, b.url))
+                least = min(b.outstanding for b in candidates)
+                if preferred.outstanding <= least + self.sticky_slack:
+                    backend = preferred
+            if backend is None:
+                backend = self._balance(candidates)
+            backend.outstanding += 1
+            backend.requests += 1
+        return backend
+
+    def release(self, backend, success=True, error=None):
+        with self.lock:
+            backend.outstanding -= 1
+            if success:
+                backend.consecutive_failures = 0
+                return
+            backend.failures += 1
+            backend.consecutive_failures += 1
+            backend.last_error = error
+            if backend.consecutive_failures >= self.max_failures:
+                self._eject(backend, f"{backend.consecutive_failures} consecutive failures")
+
+    def _score(self, affinity, url):
+        digest = hashlib.md5(f"{affinity}|{url}".encode('utf-8')).hexdigest()
+        return int(digest[:16], 16)
+
+    def _balance(self, candidates):
+        if len(candidates) == 1:
+            return candidates[0]
+        if self.strategy == 'p2c':
+            first, second = random.sample(candidates, 2)
+            return first if first.outstanding <= second.outstanding else second
+        least = min(b.outstanding for b in candidates)
+        return random.choice([b for b in candidates if b.outstanding == least])
+
+    def _eject(self, backend, reason):
+        if backend.available(time.time()):
+            logger.warning(f"Ejecting Ollama backend {backend.url}: {reason}")
+        backend.ejected_until = time.time() + self.eject_seconds
+
+    def check(self, backend):
+        try:
+            with urllib.request.urlopen(f"{backend.url}/api/tags", timeout=self.check_timeout) as response:
+                return response.status == 200, None
+        except Exception as e:
+            return False, str(e)
+
+    def _check_loop(self):
+        while True:
+            for backend in self.backends:
+                healthy, error = self.check(backend)
+                with self.lock:
+                    if healthy:
+                        if not backend.available(time.time()):
+                            logger.info(f"Re-admitting Ollama backend {backend.url}")
+                        backend.ejected_until = 0.0
+                        backend.consecutive_failures = 0
+                    else:
+                        backend.last_error = error
+                        self._eject(backend, f"health check failed: {error}")
+            time.sleep(self.check_interval)
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            backends = [backend.stats(now) for backend in self.backends]
+        return {
+            'strategy': self.strategy,
+            'available': sum(1 for backend in backends if backend['available']),
+            'backends': backends
+        }